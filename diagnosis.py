@@ -24,13 +24,14 @@ DIAG_STRICT_LABEL_PASS=1
 """
 
 from __future__ import annotations
-import os, re, sys, math, json, time, unicodedata, hashlib, pickle
+import os, re, sys, math, json, time, unicodedata, hashlib, pickle, threading
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, Any, List, Tuple, Optional
 from difflib import SequenceMatcher
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait
 
+import numpy as np
 import pandas as pd
 import requests
 
@@ -122,7 +123,10 @@ def norm(s: str|None) -> str:
     return t.strip()
 
 def read_text(p: Path) -> str:
-    return p.read_text(encoding="utf-8", errors="ignore").strip() if p.exists() else ""
+    # バイトで読んで 1 回だけデコード（改行は従来どおり \n にそろえる）
+    try: s = p.read_bytes().decode("utf-8", "ignore")
+    except OSError: return ""
+    return (s.replace("\r\n", "\n").replace("\r", "\n") if "\r" in s else s).strip()
 
 def read_assess_and_so() -> str:
     core = read_text(Path(ASSESS_FINAL_TXT))
@@ -136,8 +140,25 @@ def read_assess_and_so() -> str:
         raise FileNotFoundError("assessment_final.txt が見つからない/空、S/O もなし。")
     return "\n".join(parts)
 
+def write_bytes(path: str, data: bytes):
+    # エンコード済みバッファを低レベル I/O でそのまま書く（TextIOWrapper を経由しない）
+    fd=os.open(path, os.O_WRONLY|os.O_CREAT|os.O_TRUNC|getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        mv=memoryview(data)
+        while mv:
+            mv=mv[os.write(fd, mv):]
+    finally:
+        os.close(fd)
+
 def write_text(path: str, s: str):
-    Path(path).write_text(s, encoding="utf-8")
+    write_bytes(path, s.encode("utf-8", errors="ignore"))
+
+# ========= orjson (任意) =========
+try:
+    import orjson as _orjson
+    def json_bytes(obj) -> bytes: return _orjson.dumps(obj, option=_orjson.OPT_INDENT_2)
+except Exception:
+    def json_bytes(obj) -> bytes: return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
 
 # ========= rapidfuzz (任意) =========
 try:
@@ -371,10 +392,10 @@ def _is_bad_window(text: str, idx: int, width: int=12) -> bool:
     win=text[a:b]
     return re.search(BAD_WORDS, win) is not None
 
-def fuzzy_hits_with_polarity(text_norm: str, terms: List[str]) -> Tuple[List[str],List[str]]:
+def fuzzy_hits_with_polarity(text_norm: str, terms: List[str], toks: Optional[List[str]] = None) -> Tuple[List[str],List[str]]:
     """戻り値: (肯定ヒット, 正常/否定ヒット)"""
     pos=[]; ok=[]
-    toks=text_norm.split()
+    if toks is None: toks=text_norm.split()
     for term in terms:
         exps=[term]
         if term in SYNONYMS: exps += SYNONYMS[term]
@@ -493,19 +514,24 @@ def _trim_assess(src: str, limit: int = AI_SNIPPET_CHARS) -> str:
     core=m.group(0) if m else t
     return (core[:limit]+"…") if len(core)>limit else core
 
-def _ollama_chat(system: str, user: str, num_pred: int = 40) -> str:
+def _left(deadline: Optional[float]) -> float:
+    # 1 回の問い合わせに使える秒数（締切が無ければ READ_TO）
+    return READ_TO if deadline is None else min(READ_TO, deadline - time.time())
+
+def _ollama_chat(system: str, user: str, num_pred: int = 40, deadline: Optional[float] = None) -> str:
     try:
+        if _left(deadline) <= 0: return ""
         r=_post(OLLAMA_BASE+"/api/chat", {
             "model": OLLAMA_MODEL, "stream": False,
             "options": {"temperature": 0.2, "num_predict": num_pred},
             "messages": [{"role":"system","content":system},{"role":"user","content":user}]
-        }, READ_TO)
+        }, _left(deadline))
         if r.status_code==404:
             prompt=f"### System\n{system}\n\n### User\n{user}\n"
             r=_post(OLLAMA_BASE+"/api/generate", {
                 "model": OLLAMA_MODEL, "prompt": prompt, "stream": False,
                 "options": {"temperature": 0.2, "num_predict": num_pred}
-            }, READ_TO)
+            }, max(0.1, _left(deadline)))
         r.raise_for_status()
         data=r.json()
         if "message" in data:
@@ -514,13 +540,14 @@ def _ollama_chat(system: str, user: str, num_pred: int = 40) -> str:
     except Exception:
         return ""
 
-def ask_ollama_json(system: str, user: str, num_pred: int = 40) -> Optional[dict]:
+def ask_ollama_json(system: str, user: str, num_pred: int = 40, deadline: Optional[float] = None) -> Optional[dict]:
     for i in range(RETRY+1):
         try:
-            txt=_ollama_chat(system, user, num_pred=num_pred)
+            txt=_ollama_chat(system, user, num_pred=num_pred, deadline=deadline)
             m=re.search(r"\{[\s\S]*\}", txt)
             return json.loads(m.group(0) if m else txt)
         except Exception:
+            if _left(deadline) <= 0.3*(i+1): break  # 締切までに再試行できないなら諦める
             time.sleep(0.3*(i+1))
     return None
 
@@ -530,8 +557,13 @@ def load_cache() -> dict:
         try: return json.loads(p.read_text(encoding="utf-8"))
         except: return {}
     return {}
+# coarse/fine は並列スレッドから書き込むので、書き込みと保存時のコピーはロックの内側で行う
+_CACHE_LOCK = threading.Lock()
+
 def save_cache(c: dict):
-    try: Path(AI_CACHE_FN).write_text(json.dumps(c, ensure_ascii=False, indent=2), encoding="utf-8")
+    with _CACHE_LOCK:
+        snap={k: (dict(v) if isinstance(v, dict) else v) for k,v in c.items()}
+    try: Path(AI_CACHE_FN).write_text(json.dumps(snap, ensure_ascii=False, indent=2), encoding="utf-8")
     except: pass
 
 _CACHE=load_cache(); _CACHE.setdefault("coarse",{}); _CACHE.setdefault("fine",{})
@@ -543,19 +575,23 @@ def fine_key(assess: str, label: str, definition: str, dc: List[str], rf: List[s
     src="\n".join([OLLAMA_MODEL, norm(assess), norm(label), norm(definition), "|".join(dc), "|".join(rf), "|".join(rk)])
     return hashlib.sha1(src.encode()).hexdigest()
 
-def ai_coarse(assess: str, label: str, definition: str) -> float:
+def ai_coarse(assess: str, label: str, definition: str, deadline: Optional[float] = None) -> float:
     key=coarse_key(assess,label,definition)
-    if key in _CACHE["coarse"]: return float(_CACHE["coarse"][key])
+    with _CACHE_LOCK: hit=_CACHE["coarse"].get(key)
+    if hit is not None: return float(hit)
     if not ollama_available(): return 0.0
-    data=ask_ollama_json(AI_SYS_COARSE, f"【看護診断】{label}\n【定義】{definition}\n\n【アセスメント本文（要旨）】\n{_trim_assess(assess)}", 40) or {}
-    score=float(data.get("score",0.0) or 0.0)
-    _CACHE["coarse"][key]=score
+    data=ask_ollama_json(AI_SYS_COARSE, f"【看護診断】{label}\n【定義】{definition}\n\n【アセスメント本文（要旨）】\n{_trim_assess(assess)}", 40, deadline)
+    if data is None and deadline is not None and time.time() >= deadline:
+        return 0.0  # 締切で打ち切った分は 0 点としてキャッシュしない
+    score=float((data or {}).get("score",0.0) or 0.0)
+    with _CACHE_LOCK: _CACHE["coarse"][key]=score
     return score
 
-def ai_fine(assess: str, label: str, definition: str, dc_terms: List[str], rf_terms: List[str], rk_terms: List[str]) -> Tuple[float, Dict[str,List[str]]]:
+def ai_fine(assess: str, label: str, definition: str, dc_terms: List[str], rf_terms: List[str], rk_terms: List[str],
+            deadline: Optional[float] = None) -> Tuple[float, Dict[str,List[str]]]:
     key=fine_key(assess,label,definition,dc_terms,rf_terms,rk_terms)
-    if key in _CACHE["fine"]:
-        v=_CACHE["fine"][key]
+    with _CACHE_LOCK: v=_CACHE["fine"].get(key)
+    if v is not None:
         return float(v.get("score",0.0)), {"診断指標":v.get("dc",[]),"関連因子":v.get("rf",[]),"危険因子":v.get("rk",[])}
     if not ollama_available():
         return 0.0, {"診断指標":[],"関連因子":[],"危険因子":[]}
@@ -566,51 +602,72 @@ def ai_fine(assess: str, label: str, definition: str, dc_terms: List[str], rf_te
         f"【危険因子リスト】{', '.join(rk_terms) if rk_terms else '（なし）'}\n\n"
         "【アセスメント本文（要旨）】\n"+_trim_assess(assess)
     )
-    data=ask_ollama_json(AI_SYS_FINE, user, 40) or {}
+    data=ask_ollama_json(AI_SYS_FINE, user, 40, deadline)
+    if data is None and deadline is not None and time.time() >= deadline:
+        return 0.0, {"診断指標":[],"関連因子":[],"危険因子":[]}  # 締切で打ち切った分はキャッシュしない
+    data=data or {}
     score=float(data.get("score",0.0) or 0.0)
     matched=data.get("matched",{}) or {}
     ev={"診断指標":[nfkc(x).strip() for x in matched.get("診断指標",[]) if str(x).strip()],
         "関連因子":[nfkc(x).strip() for x in matched.get("関連因子",[]) if str(x).strip()],
         "危険因子":[nfkc(x).strip() for x in matched.get("危険因子",[]) if str(x).strip()]}
-    _CACHE["fine"][key]={"score":score,"dc":ev["診断指標"],"rf":ev["関連因子"],"rk":ev["危険因子"]}
+    with _CACHE_LOCK: _CACHE["fine"][key]={"score":score,"dc":ev["診断指標"],"rf":ev["関連因子"],"rk":ev["危険因子"]}
     return max(0.0,min(1.0,score)), ev
 
 # ========= ルール/スコア =========
 _NUM=r"(\d+(?:\.\d+)?)"
-def fnum(pat: str, text: str) -> Optional[float]:
-    m=re.search(pat, text, flags=re.IGNORECASE)
+def fnum(pat, text: str) -> Optional[float]:
+    m=(pat.search(text) if hasattr(pat, "search") else re.search(pat, text, flags=re.IGNORECASE))
     return float(m.group(1)) if m else None
 
+# バイタル用パターンは読み込み時に1回だけコンパイル
+_RE_VT_T    = re.compile(r"(?:体温|t)\s*[:=]?\s*"+_NUM, re.IGNORECASE)
+_RE_VT_HR   = re.compile(r"(?:hr|心拍|脈拍)\s*[:=]?\s*"+_NUM, re.IGNORECASE)
+_RE_VT_RR   = re.compile(r"(?:rr|呼吸数)\s*[:=]?\s*"+_NUM, re.IGNORECASE)
+_RE_VT_SPO2 = re.compile(r"(?:spo2|ｓｐｏ２|サチュ)\s*[:=]?\s*"+_NUM, re.IGNORECASE)
+_RE_VT_BP   = re.compile(r"\b(\d{2,3})\s*/\s*(\d{2,3})\b", re.IGNORECASE)
+_RE_VT_SBP  = re.compile(r"(?:sbp|収縮期|上の血圧)\s*[:=]?\s*"+_NUM, re.IGNORECASE)
+_RE_VT_DBP  = re.compile(r"(?:dbp|拡張期|下の血圧)\s*[:=]?\s*"+_NUM, re.IGNORECASE)
+_RE_VT_NRS  = re.compile(r"(?:nrs|疼痛(?:スケール)?)\D{0,6}"+_NUM, re.IGNORECASE)
+
 def parse_vitals(text: str) -> Dict[str, Optional[float]]:
-    T    = fnum(r"(?:体温|t)\s*[:=]?\s*"+_NUM, text)
-    HR   = fnum(r"(?:hr|心拍|脈拍)\s*[:=]?\s*"+_NUM, text)
-    RR   = fnum(r"(?:rr|呼吸数)\s*[:=]?\s*"+_NUM, text)
-    SpO2 = fnum(r"(?:spo2|ｓｐｏ２|サチュ)\s*[:=]?\s*"+_NUM, text)
-    bp   = re.search(r"\b(\d{2,3})\s*/\s*(\d{2,3})\b", text, re.IGNORECASE)
-    SBP  = float(bp.group(1)) if bp else fnum(r"(?:sbp|収縮期|上の血圧)\s*[:=]?\s*"+_NUM, text)
-    DBP  = float(bp.group(2)) if bp else fnum(r"(?:dbp|拡張期|下の血圧)\s*[:=]?\s*"+_NUM, text)
+    T    = fnum(_RE_VT_T, text)
+    HR   = fnum(_RE_VT_HR, text)
+    RR   = fnum(_RE_VT_RR, text)
+    SpO2 = fnum(_RE_VT_SPO2, text)
+    bp   = _RE_VT_BP.search(text)
+    SBP  = float(bp.group(1)) if bp else fnum(_RE_VT_SBP, text)
+    DBP  = float(bp.group(2)) if bp else fnum(_RE_VT_DBP, text)
     MAP  = (SBP + 2*DBP)/3 if (SBP is not None and DBP is not None) else None
-    NRS  = fnum(r"(?:nrs|疼痛(?:スケール)?)\D{0,6}"+_NUM, text)
+    NRS  = fnum(_RE_VT_NRS, text)
     return {"T":T,"HR":HR,"RR":RR,"SpO2":SpO2,"SBP":SBP,"DBP":DBP,"MAP":MAP,"NRS":NRS}
 
-def score_match_blocks(text: str, row: Dict[str,Any]) -> Tuple[float, Dict[str,List[str]], List[str]]:
-    t=norm(text); reasons=[]
-    dc_terms=split_terms(row.get("defining_characteristics",""))
-    rf_terms=split_terms(row.get("related_factors",""))
-    rk_terms=split_terms(row.get("risk_factors",""))
-    pos_dc, ok_dc = fuzzy_hits_with_polarity(t, dc_terms)
-    pos_rf, ok_rf = fuzzy_hits_with_polarity(t, rf_terms)
-    pos_rk, ok_rk = fuzzy_hits_with_polarity(t, rk_terms)
+def score_match_blocks(text: str, row: Dict[str,Any], t: Optional[str] = None, v: Optional[dict] = None,
+                       toks: Optional[List[str]] = None, terms: Optional[Tuple[List[str],List[str],List[str]]] = None
+                       ) -> Tuple[float, Dict[str,List[str]], List[str]]:
+    # t/v/toks/terms は呼び出し側で前計算済みなら渡す（collect では1回だけ計算）
+    if t is None: t=norm(text)
+    if v is None: v=parse_vitals(text)
+    if toks is None: toks=t.split()
+    reasons=[]
+    if terms is None:
+        terms=(split_terms(row.get("defining_characteristics","")),
+               split_terms(row.get("related_factors","")),
+               split_terms(row.get("risk_factors","")))
+    dc_terms, rf_terms, rk_terms = terms
+    pos_dc, ok_dc = fuzzy_hits_with_polarity(t, dc_terms, toks)
+    pos_rf, ok_rf = fuzzy_hits_with_polarity(t, rf_terms, toks)
+    pos_rk, ok_rk = fuzzy_hits_with_polarity(t, rk_terms, toks)
 
     base = W_RULE_DC*len(pos_dc) + W_RULE_RF*len(pos_rf) + W_RULE_RK*len(pos_rk)
     if ok_dc or ok_rf or ok_rk:
         reasons.append(f"正常/陰性と判断: DC{len(ok_dc)} RF{len(ok_rf)} RK{len(ok_rk)}")
-    if "痛" in row.get("label","") and parse_vitals(text).get("NRS") is not None:
-        n=parse_vitals(text)["NRS"]
+    if "痛" in row.get("label","") and v.get("NRS") is not None:
+        n=v["NRS"]
         if n>=7: base+=1.5; reasons.append("数値:NRS≥7")
         elif n>=4: base+=0.8; reasons.append("数値:NRS≥4")
 
-    hint=norm(row.get("priority_hint","")); v=parse_vitals(text)
+    hint=norm(row.get("priority_hint",""))
     if any(k in hint for k in ("呼吸","airway","breathing")):
         base += W_HINT_RESP*(1.0 + (1.0 if (v.get("SpO2") and v["SpO2"]<90) else 0.0))
     if any(k in hint for k in ("循環","circulation")):
@@ -672,8 +729,9 @@ def penalty_setting(row: dict, assess_settings: set) -> Tuple[float,str]:
     if not lack: return 0.0,""
     return P_SETTING_MISMATCH, f"場面根拠弱({', '.join(lack)})"
 
-def penalty_contradict(assess: str, row: dict) -> Tuple[float,str]:
-    t=norm(assess); v=parse_vitals(assess)
+def penalty_contradict(assess: str, row: dict, t: Optional[str] = None, v: Optional[dict] = None) -> Tuple[float,str]:
+    if t is None: t=norm(assess)
+    if v is None: v=parse_vitals(assess)
     lbl=row.get("label","")+" "+row.get("definition","")
     if re.search(r"呼吸|酸素|気道|SpO2|息切|喘", lbl):
         no_words=not re.search(r"呼吸|息|SpO2|喘|RR", t)
@@ -685,6 +743,61 @@ def penalty_contradict(assess: str, row: dict) -> Tuple[float,str]:
         return P_CONTRADICT, "疼痛所見/語彙が弱い"
     return 0.0, ""
 
+# ========= 行特徴量（1行1回でまとめて計算） =========
+def _prep_assess_context(assess: str) -> Dict[str,Any]:
+    """本文側の前処理（正規化・トークン・バイタル・属性）を1回だけ行う"""
+    tnorm=norm(assess)
+    return {
+        "assess": assess,
+        "tnorm": tnorm,
+        "toks": tnorm.split(),
+        "vitals": parse_vitals(assess),
+        "demo": parse_demo(assess),
+        "settings": parse_setting(assess),
+        "cats": extract_categories_from_text(assess),
+    }
+
+def _prep_row_features(row: Dict[str,Any], ctx: Dict[str,Any]) -> Dict[str,Any]:
+    """1行ぶんの split_terms / ルール一致 / 厳格フィルタ / ペナルティを一度に計算する"""
+    assess=ctx["assess"]; t=ctx["tnorm"]; v=ctx["vitals"]; demo=ctx["demo"]
+    terms=(split_terms(row.get("defining_characteristics","")),
+           split_terms(row.get("related_factors","")),
+           split_terms(row.get("risk_factors","")))
+    rule_raw, loose, reasons0 = score_match_blocks(assess, row, t=t, v=v, toks=ctx["toks"], terms=terms)
+
+    ok_ct, why_ct   = row_care_target_ok(row, demo)
+    ok_age, why_age = row_age_ok(row, demo)
+    ok_sex, why_sex = row_sex_ok(row, demo)
+    ok_cat, why_cat = row_category_ok(row, ctx["cats"])
+    p1,w1 = penalty_setting(row, ctx["settings"])
+    p3,w3 = penalty_contradict(assess, row, t=t, v=v)
+    return {
+        "terms": terms,
+        "rule_raw": rule_raw, "loose": loose, "reasons0": reasons0,
+        "checks": ((ok_ct,why_ct),(ok_age,why_age),(ok_sex,why_sex),(ok_cat,why_cat)),
+        "ok_cat": ok_cat, "why_cat": why_cat,
+        "hard_ok": ok_ct and ok_age and ok_sex and ok_cat,
+        "p1": p1, "w1": w1, "p3": p3, "w3": w3,
+    }
+
+# ========= 予算付き並列 =========
+def _fanout(fn, items, workers: int, budget_sec: float) -> list:
+    """items を並列に fn(item, deadline) へ投げ、予算秒内に終わった結果だけ返す。
+    各呼び出しは deadline までに打ち切られるので、締切後は未着手分を取り消して実行中の分の終了を短く待つ
+    （放置したスレッドは終了時の join で結局待たされ、キャッシュにも書き続けるため）。"""
+    items=list(items)
+    if not items: return []
+    deadline=time.time()+max(0.1, budget_sec)
+    ex=ThreadPoolExecutor(max_workers=max(1, workers))
+    futs=[ex.submit(fn, i, deadline) for i in items]
+    done,_=wait(futs, timeout=max(0.1, budget_sec))
+    ex.shutdown(wait=True, cancel_futures=True)
+    res=[]
+    for f in done:
+        try: res.append(f.result())
+        except Exception: pass
+    return res
+
 # ========= 収集・選抜（高速化の肝） =========
 def collect(assess: str, rows: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
     # 壁時計締切
@@ -692,27 +805,24 @@ def collect(assess: str, rows: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
     def time_left():
         return (deadline - time.time()) if deadline else 9999
 
-    tnorm=norm(assess)
+    ctx=_prep_assess_context(assess)
+    tnorm=ctx["tnorm"]
     assess_tokens=tokenize(tnorm)
     idfmap, def_vecs = build_definition_space(rows)
     assess_vec=tfidf_vec(assess_tokens, idfmap)
 
-    demo     = parse_demo(assess)
-    settings = parse_setting(assess)
-    text_cats= extract_categories_from_text(assess)
-
     # 課題ラベル（本文）→ 検索語（同義含む）を作る
     label_hints = extract_label_hints_from_text(assess)
     expanded_norm = set()
     for h in label_hints:
         expanded_norm |= {norm(q) for q in expand_label_to_queries(h)}
 
-    # 事前スコア（定義類似 + ルール粗計算）
+    # 事前スコア（定義類似 + ルール粗計算）。行特徴量はここで1回だけ作って build_cand でも再利用
+    feats=[_prep_row_features(r, ctx) for r in rows]
     pre=[]
     for i,r in enumerate(rows):
         def_sim=cos_dict(assess_vec, def_vecs[i])
-        rule_raw, _, _ = score_match_blocks(assess, r)
-        pre.append((i, def_sim, rule_raw))
+        pre.append((i, def_sim, feats[i]["rule_raw"]))
 
     # ラベル一致の強化：診断名/定義に課題語が何個入るか
     label_boost = [0.0]*len(rows)
@@ -731,24 +841,24 @@ def collect(assess: str, rows: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
     # 厳格フィルタ
     hard_ok=[True]*len(rows); cat_reason=[""]*len(rows)
     for i,_ds,_rs in pre:
-        r=rows[i]
-        ok_ct,_ = row_care_target_ok(r, demo)
-        ok_ag,_ = row_age_ok(r, demo)
-        ok_sx,_ = row_sex_ok(r, demo)
-        ok_cat, why_cat = row_category_ok(r, text_cats)
-        hard_ok[i]= ok_ct and ok_ag and ok_sx and ok_cat
+        f=feats[i]
+        ok_cat, why_cat = f["ok_cat"], f["why_cat"]
+        hard_ok[i]= f["hard_ok"]
         cat_reason[i]= ("OK: "+why_cat) if (ok_cat and why_cat) else (("NG: "+why_cat) if why_cat else "")
 
     eligible=[i for i in range(len(rows)) if hard_ok[i]]
     if not eligible: eligible=list(range(len(rows)))
+    eligible_set=set(eligible)
 
     # 緩い足切り（+ ラベル未一致で def/rule が弱いものは落とす）
+    # 安い特徴量（def_sim / rule_raw）の足切り判定は 1 か所で作り、kept と AI の対象絞り込みで共用する
+    cheap_ok=[ds >= MIN_DEF_SIM_KEEP or rs >= MIN_RULE_SCORE_KEEP for _i,ds,rs in pre]
     kept=[]
     for i,ds,rs in pre:
-        if i not in eligible: continue
+        if i not in eligible_set: continue
         if not label_pass[i] and (ds < (MIN_DEF_SIM_KEEP*1.2) and rs < (MIN_RULE_SCORE_KEEP*1.2)):
             continue
-        if ds < MIN_DEF_SIM_KEEP and rs < MIN_RULE_SCORE_KEEP:
+        if not cheap_ok[i]:
             continue
         kept.append(i)
     if not kept: kept = eligible
@@ -766,24 +876,20 @@ def collect(assess: str, rows: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
         return 0.6*ds + 0.4*min(1.0, rr/4.0) + 0.1*bonus + 0.2*label_boost[i]
 
     order=sorted(kept, key=quick_score, reverse=True)
-    ai_targets=set(order[:AI_TOPK]) if AI_TOPK>0 else set()
+    # 安い特徴量の足切り（cheap_ok）を通らない行には AI を使わない。
+    # 全滅時（kept が eligible へフォールバックした場合）だけは従来どおり上位に AI を当てる
+    gated=[i for i in order if cheap_ok[i]] or order
+    ai_targets=set(gated[:AI_TOPK]) if AI_TOPK>0 else set()
 
     ai_coarse_s=[0.0]*len(rows)
-    def task_coarse(i):
+    def task_coarse(i, deadline):
         r=rows[i]
-        return i, ai_coarse(assess, r.get("label",""), r.get("definition",""))
+        return i, ai_coarse(assess, r.get("label",""), r.get("definition",""), deadline)
 
     if ai_targets and ollama_available() and (time_left() > 1.0):
-        futures=[]
-        with ThreadPoolExecutor(max_workers=max(1, COARSE_CONCURRENCY)) as ex:
-            for i in ai_targets: futures.append(ex.submit(task_coarse, i))
-            end = time.time() + min(COARSE_BUDGET_SEC or 9e9, max(1.0, time_left()))
-            for fut in as_completed(futures, timeout=max(0.1, end - time.time())):
-                if time.time() >= end: break
-                try:
-                    i,s=fut.result(timeout=max(0.1, end - time.time()))
-                    ai_coarse_s[i]=float(s)
-                except Exception: pass
+        budget = min(COARSE_BUDGET_SEC or 9e9, max(1.0, time_left()))
+        for i,s in _fanout(task_coarse, ai_targets, COARSE_CONCURRENCY, budget):
+            ai_coarse_s[i]=float(s)
 
     # fine 対象（上位60% & 閾値通過）
     out=[None]*len(rows)
@@ -792,19 +898,18 @@ def collect(assess: str, rows: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
     fine_pool=[i for i,_ in co_list[:cut] if ai_coarse_s[i]>=COARSE_MIN_PASS and ollama_available()]
     early_accept={i for i,s in co_list if s>=0.82}
 
+    # 数値列は SoA（行ごとの numpy 配列）で持ち、並べ替え/足切りは配列演算で行う
+    SORT_COLS=("related","score","ai_sim","ai_coarse","def_sim","rule_raw")
+    cols={k: np.zeros(len(rows), np.float64) for k in SORT_COLS}  # 丸め後の比較が従来（Python float）と同じになるよう float64
+
     def build_cand(i, s_coarse: float, s_fine: float=0.0, ai_ev=None):
-        r=rows[i]
+        r=rows[i]; f=feats[i]
         ds=pre[i][1]
-        rule_raw, loose, reasons0 = score_match_blocks(assess, r)
-
-        ok_ct, why_ct   = row_care_target_ok(r, demo)
-        ok_age, why_age = row_age_ok(r, demo)
-        ok_sex, why_sex = row_sex_ok(r, demo)
-        ok_cat, why_cat = row_category_ok(r, text_cats)
-        hard_ok = ok_ct and ok_age and ok_sex and ok_cat
-
-        p1,w1 = penalty_setting(r, settings)
-        p3,w3 = penalty_contradict(assess, r)
+        rule_raw, loose, reasons0 = f["rule_raw"], f["loose"], f["reasons0"]
+        ok_cat, why_cat = f["ok_cat"], f["why_cat"]
+        hard_ok = f["hard_ok"]
+        p1,w1 = f["p1"], f["w1"]
+        p3,w3 = f["p3"], f["w3"]
         # ヒット弱は“減点”
         dc_hits = len(loose.get("診断指標",[])) + len((ai_ev or {}).get("診断指標",[]))
         rk_hits = len(loose.get("危険因子",[])) + len((ai_ev or {}).get("危険因子",[]))
@@ -829,11 +934,19 @@ def collect(assess: str, rows: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
         related = hard_ok and (related_basic or total>=2.0)
 
         reasons=list(reasons0)
-        for ok,why in ((ok_ct,why_ct),(ok_age,why_age),(ok_sex,why_sex),(ok_cat,why_cat)):
+        for ok,why in f["checks"]:
             if why: reasons.append(("OK: " if ok else "NG: ")+why)
         for w in (w1,w2,w3):
             if w: reasons.append(f"penalty: {w} (-{penalty:.1f})")
 
+        # 並べ替えキーは Python の round() で丸めた値を入れる（np.round とは端数 .5 の扱いが違い、同点の順が変わるため）
+        cols["related"][i]=1.0 if related else 0.0
+        cols["score"][i]=round(total, 3)
+        cols["ai_sim"][i]=round(float(s_fine), 3)
+        cols["ai_coarse"][i]=round(float(s_coarse), 3)
+        cols["def_sim"][i]=round(float(ds), 4)
+        cols["rule_raw"][i]=round(float(rule_raw), 3)
+
         return {
             "code": (r.get("code","") or "").strip() or "00000",
             "label": r.get("label","").strip() or "(診断名未設定)",
@@ -865,25 +978,16 @@ def collect(assess: str, rows: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
             "score": round(total, 3),
         }
 
-    def task_fine(i):
+    def task_fine(i, deadline):
         r=rows[i]
-        dc=split_terms(r.get("defining_characteristics",""))
-        rf=split_terms(r.get("related_factors",""))
-        rk=split_terms(r.get("risk_factors",""))
-        s,ev=ai_fine(assess, r.get("label",""), r.get("definition",""), dc, rf, rk)
+        dc,rf,rk=feats[i]["terms"]
+        s,ev=ai_fine(assess, r.get("label",""), r.get("definition",""), dc, rf, rk, deadline)
         return i,s,ev
 
     if fine_pool and (time_left() > 1.0):
-        futures=[]
-        with ThreadPoolExecutor(max_workers=max(1,FINE_CONCURRENCY)) as ex:
-            for i in fine_pool: futures.append(ex.submit(task_fine,i))
-            end = time.time() + min(FINE_BUDGET_SEC or 9e9, max(1.0, time_left()))
-            for fut in as_completed(futures, timeout=max(0.1, end - time.time())):
-                if time.time() >= end: break
-                try:
-                    i,s,ev=fut.result(timeout=max(0.1, end - time.time()))
-                    out[i]=build_cand(i, ai_coarse_s[i], s, ev)
-                except Exception: pass
+        budget = min(FINE_BUDGET_SEC or 9e9, max(1.0, time_left()))
+        for i,s,ev in _fanout(task_fine, fine_pool, FINE_CONCURRENCY, budget):
+            out[i]=build_cand(i, ai_coarse_s[i], s, ev)
 
     for i in early_accept:
         if out[i] is None:
@@ -893,16 +997,20 @@ def collect(assess: str, rows: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
         if out[i] is None:
             out[i]=build_cand(i, ai_coarse_s[i], 0.0, None)
 
-    # 並べ替え
-    cands=list(out)
-    cands.sort(key=lambda x:( x["related"], round(x["score"],3), round(x["ai_sim"],3),
-                              round(x["ai_coarse"],3), round(x["def_sim"],4), round(x["rule_raw"],3) ), reverse=True)
+    # 並べ替え（降順・安定。lexsort は最後のキーが第1キー）
+    # 列は build_cand で丸め済みなので、従来の sort(key=(related, round(score,3), ...), reverse=True) と同じ順になる
+    order=np.lexsort((
+        -cols["rule_raw"], -cols["def_sim"], -cols["ai_coarse"],
+        -cols["ai_sim"], -cols["score"], -cols["related"],
+    ))
+    cands=[out[j] for j in order]
     for idx,c in enumerate(cands, start=1):
         c["ai_rank"]=idx
 
     # 関連が薄いのを落とす（全部ゼロの時は保険で上位だけ残す）
     if OUT_REQUIRE_RELATED:
-        vis=[c for c in cands if c["related"] and c["score"]>0.0]
+        mask=(cols["related"][order]>0) & (cols["score"][order]>0.0)
+        vis=[cands[j] for j in np.flatnonzero(mask)]
         if not vis:
             k=max(3, int(len(cands)*OUT_TOP_FRAC))
             vis=cands[:k]
@@ -1001,7 +1109,7 @@ def main():
         },
         "candidates": cands
     }
-    write_text(RESULT_JSON, json.dumps(j, ensure_ascii=False, indent=2)); print(f"[SAVE] {RESULT_JSON}")
+    write_bytes(RESULT_JSON, json_bytes(j)); print(f"[SAVE] {RESULT_JSON}")
 
     # 成功時もキャッシュを保存（2回目以降をさらに速く）
     try: save_cache(_CACHE)
@@ -32,7 +32,8 @@ _ensure_pyqt5()
 # 3) HiDPI / Qt の既定（サイズ感固定）
 os.environ.setdefault("PYTHONUTF8", "0")
 os.environ.setdefault("QT_AUTO_SCREEN_SCALE_FACTOR", "0")
-if platform.system().lower().startswith("win"):
+_SYS = platform.system().lower()   # 1 回だけ判定して使い回す
+if _SYS.startswith("win"):
     os.environ.setdefault("QT_ENABLE_HIGHDPI_SCALING", "0")
 
 # 4) AI をローカル固定（OpenAI 完全遮断）
@@ -44,8 +45,8 @@ os.environ.pop("OPENAI_API_KEY", None)  # 万一 .env 等にあっても無効
 # ========================================================================
 
 # 以降は元の先頭インポートに続けてOK
-import os as _os, sys as _sys, subprocess as _subprocess, re, shutil, time, platform as _platform, json, getpass
-from pathlib import Path as _Path
+import re, shutil, time, json, getpass, threading, functools, struct
+from collections import OrderedDict, deque
 from typing import Optional, List, Dict, Any
 
 # ==== Qt plugins self-heal (Windows) ====
@@ -68,19 +69,21 @@ def _fix_qt_plugin_path():
     except Exception:
         pass
 
-_fix_qt_plugin_path()
+if sys.platform.startswith("win"):
+    _fix_qt_plugin_path()
 # ========================================
 
 # （ここから下の PyQt5 import はそのままで大丈夫）
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import (Qt, QThread, QThreadPool, QTimer, pyqtSignal, QAbstractTableModel, QModelIndex,
+                          QObject, QProcess, QProcessEnvironment)
 from PyQt5.QtGui import QFont, QTextOption
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QTextEdit, QPushButton, QTabWidget, QMessageBox, QStatusBar,
     QLineEdit, QCheckBox, QDialog, QFormLayout, QDialogButtonBox, QAction,
-    QFileDialog, QProgressDialog, QSplitter, QTreeWidget, QTreeWidgetItem,
-    QHeaderView, QInputDialog, QToolBar, QAbstractItemView, QTableWidget,
-    QTableWidgetItem, QGroupBox, QGridLayout, QStackedWidget, QPlainTextEdit,
+    QFileDialog, QProgressDialog, QSplitter, QTreeView,
+    QHeaderView, QInputDialog, QToolBar, QAbstractItemView, QTableView,
+    QGroupBox, QGridLayout, QStackedWidget, QPlainTextEdit,
     QScrollArea
 )
 
@@ -145,37 +148,88 @@ def _cmd_for(script_py: str, exe_name: str) -> list[str]:
 # ------------------------------------------------------------
 
 # ================ ユーティリティ ================
+# 読み込み結果キャッシュ: パス -> ((mtime_ns, size, ino, ctime_ns), 文字列)。変化が無ければ再読込・再デコードしない
+# mtime の粒度が粗い FS（FAT/exFAT・一部のネットワーク共有）で同サイズに書き直されても取り違えないよう、
+# スクリプトのジョブが終わるたびに全体を捨てる（_script_job）
+_READ_CACHE: Dict[str, tuple] = {}
+
 def read_text_safe(p: Path) -> str:
-    if not p.exists(): return ""
-    try:    return p.read_text(encoding="utf-8")
-    except: return p.read_text(encoding="utf-8", errors="ignore")
+    try: st = p.stat()
+    except OSError:
+        _READ_CACHE.pop(str(p), None); return ""
+    sig = (st.st_mtime_ns, st.st_size, st.st_ino, st.st_ctime_ns)
+    hit = _READ_CACHE.get(str(p))
+    if hit and hit[0] == sig: return hit[1]
+    data = p.read_bytes()
+    try:    s = data.decode("utf-8")
+    except UnicodeDecodeError: s = data.decode("utf-8", "ignore")
+    _READ_CACHE[str(p)] = (sig, s)
+    return s
 
 def write_text_safe(p: Path, s: str) -> None:
+    _READ_CACHE.pop(str(p), None)
     p.write_text(s, encoding="utf-8", errors="ignore")
 
+# orjson（任意）: バイト列を str にデコードせず直接パース
+try:
+    import orjson as _orjson
+    def json_loads_bytes(b: bytes): return _orjson.loads(b)
+except Exception:
+    def json_loads_bytes(b: bytes): return json.loads(b.decode("utf-8", "ignore"))
+
 def ensure_file(fn: str):
     p = Path(fn)
     if not p.exists(): write_text_safe(p, "")
 
+_WS_TBL = str.maketrans("", "", " \u3000\t")
+
+@functools.lru_cache(maxsize=32)  # 「最新結果を表示」の連打など同じ本文の再処理を省く
 def dedupe(s: str) -> str:
-    paras = [p.strip() for p in s.split("\n\n")]
+    # 1 パスで段落（空行区切り）と行を重複除去。比較キーは空白除去形を1回だけ作る
     seen_p = set(); out_p = []
-    for p in paras:
-        key = p.replace(" ", "").replace("\u3000", "")
+    lines = []; keys = []
+    def flush():
+        key = "\n".join(keys).strip()
         if key and key not in seen_p:
             seen_p.add(key)
             seen_l = set(); out_l = []
-            for ln in p.splitlines():
-                ln = ln.rstrip()
-                if ln and ln not in seen_l:
-                    seen_l.add(ln); out_l.append(ln)
+            for ln, k in zip(lines, keys):
+                if k and k not in seen_l:
+                    seen_l.add(k); out_l.append(ln)
             out_p.append("\n".join(out_l))
+        lines.clear(); keys.clear()
+    for raw in s.splitlines():
+        if not raw:
+            if lines: flush()
+            continue
+        ln = raw.rstrip()
+        lines.append(ln); keys.append(ln.translate(_WS_TBL))
+    if lines: flush()
     cleaned = "\n\n".join(out_p).strip()
     return cleaned or s.strip()
 
 def alert(parent, title, msg): QMessageBox.warning(parent, title, msg)
 def info(parent, title, msg):  QMessageBox.information(parent, title, msg)
 
+def user_excel_dst() -> Path:
+    return USER_XLSX_ROOT / (getpass.getuser() or "user") / "nanda_db.xlsx"
+
+_EXCEL_SYNC_LOCK = threading.Lock()
+
+def sync_user_excel(src: Path) -> Path:
+    """ユーザー用コピーを最新化（GUI に触れないのでワーカースレッドからも呼べる）"""
+    dst = user_excel_dst()
+    with _EXCEL_SYNC_LOCK:
+        try:
+            sst = src.stat()
+            try: dst_mtime = dst.stat().st_mtime
+            except FileNotFoundError:
+                dst.parent.mkdir(parents=True, exist_ok=True); dst_mtime = None
+            if dst_mtime is None or sst.st_mtime > dst_mtime: shutil.copy2(src, dst)
+        except Exception as e:
+            sys.stderr.write(f"[警告] Excel コピーの準備に失敗: {e}\n")
+    return dst
+
 # ================ アプリ設定（JSON） ================
 def load_app_settings() -> Dict[str, Any]:
     if APP_SETTINGS_JSON.exists():
@@ -188,24 +242,38 @@ def save_app_settings(js: Dict[str, Any]) -> None:
     except: pass
 
 # ================ 外部プロセス実行（非同期） ================
+# 子プロセス用の環境は起動時に 1 回だけ組む（run ごとに os.environ.copy() しない）
+_BASE_ENV = {**os.environ, "PYTHONIOENCODING": "utf-8", "PYTHONUTF8": "1", "AI_LOG_DISABLE": "1"}
+_BASE_ENV.setdefault("LANG", "C.UTF-8"); _BASE_ENV.setdefault("LC_ALL", "C.UTF-8")
+# AI を使う子プロセス用: OpenAI を無効化した環境を**強制**注入（これも 1 回だけ組む）
+_AI_OVERRIDES = {"AI_PROVIDER": "ollama", "OLLAMA_HOST": "http://127.0.0.1:11434", "OPENAI_API_KEY": "", "AI_LOG_DISABLE": "1"}
+_AI_ENV = {**_BASE_ENV, **_AI_OVERRIDES}
+# アプリが `ollama serve` を起こすときの既定（利用者が環境変数で指定していればそちらを優先）:
+# 同じモデルへの要求を 2 本まで並列に処理し、読み込むモデルは 1 つに抑えてメモリを食い過ぎない
+_OLLAMA_SERVE_ENV = {"OLLAMA_NUM_PARALLEL": "2", "OLLAMA_MAX_LOADED_MODELS": "1", **_BASE_ENV}
+
+_POPEN_FAST = {"close_fds": False} if os.name != "nt" else {}
+
 class ProcRunner(QThread):
     finished_ok  = pyqtSignal(str)
     finished_err = pyqtSignal(str)
-    def __init__(self, cmd: list[str], stdin_text: str = "", env_overrides: dict | None = None, shell: bool=False):
+    def __init__(self, cmd: list[str], stdin_text: str = "", env_overrides: dict | None = None, shell: bool=False,
+                 env: dict | None = None):
         super().__init__()
         self.cmd = cmd; self.stdin_text = stdin_text
-        self.env_overrides = env_overrides or {}; self.shell = shell
+        self.env_overrides = env_overrides or {}; self.shell = shell; self.base_env = env or _BASE_ENV
     def run(self):
         try:
-            env = os.environ.copy()
-            env["PYTHONIOENCODING"]="utf-8"; env["PYTHONUTF8"]="1"
-            env.setdefault("LANG","C.UTF-8"); env.setdefault("LC_ALL","C.UTF-8")
-            env["AI_LOG_DISABLE"]="1"; env.update(self.env_overrides)
+            env = {**self.base_env, **self.env_overrides} if self.env_overrides else self.base_env
+            # バイナリパイプで受けて最後に 1 回だけデコード（TextIOWrapper を挟まない）
+            # POSIX だけ close_fds=False で posix_spawn() 経路を使う（Python 側の fd は既定で継承不可なので漏れない）。
+            # Windows では継承可能ハンドル（同時に動く他の ProcRunner のパイプ端など）が全部子へ渡ってしまうので既定のまま
             proc = subprocess.Popen(
                 self.cmd if not self.shell else " ".join(self.cmd),
                 stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                text=True, encoding="utf-8", errors="ignore", env=env, shell=self.shell)
-            out, err = proc.communicate(input=self.stdin_text)
+                bufsize=-1, env=env, shell=self.shell, **_POPEN_FAST)
+            out_b, err_b = proc.communicate(input=(self.stdin_text or "").encode("utf-8", "ignore"))
+            out = out_b.decode("utf-8", "ignore"); err = err_b.decode("utf-8", "ignore")
             if proc.returncode != 0:
                 self.finished_err.emit(((err or "")+"\n"+(out or "")).strip() or f"returncode:{proc.returncode}")
             else:
@@ -213,7 +281,99 @@ class ProcRunner(QThread):
         except Exception as e:
             self.finished_err.emit(str(e))
 
+# ================ 常駐スクリプトワーカー ================
+WORKER_SCRIPT = "script_worker.py"
+
+class ScriptWorker(QObject):
+    """script_worker.py を常駐させ、実行要求を長さ付き JSON フレームで送る（1 件ずつ順に処理）"""
+    def __init__(self, env: dict, parent=None):
+        super().__init__(parent)
+        self.env = env; self.proc: Optional[QProcess] = None
+        self._buf = b""; self._queue: deque = deque(); self._current = None
+    def warm(self):
+        if self.proc is not None and self.proc.state() != QProcess.NotRunning: return
+        p = QProcess(self); p.setProcessChannelMode(QProcess.ForwardedErrorChannel)
+        qenv = QProcessEnvironment()
+        for k, v in self.env.items(): qenv.insert(k, v)
+        p.setProcessEnvironment(qenv)
+        p.readyReadStandardOutput.connect(self._on_ready); p.finished.connect(self._on_exit)
+        self.proc = p; self._buf = b""
+        p.start(sys.executable, ["-X", "utf8", WORKER_SCRIPT])
+    def submit(self, job: "WorkerJob"):
+        self._queue.append(job); self._next()
+    def stop(self):
+        if self.proc is None or self.proc.state() == QProcess.NotRunning: return
+        self.proc.closeWriteChannel()  # stdin を閉じるとワーカーはループを抜ける
+        if not self.proc.waitForFinished(1000): self.proc.kill(); self.proc.waitForFinished(1000)
+    def _next(self):
+        if self._current is not None or not self._queue: return
+        self.warm(); self._current = job = self._queue.popleft()
+        b = json.dumps({"script": job.script, "stdin": job.stdin_text}, ensure_ascii=False).encode("utf-8")
+        self.proc.write(struct.pack(">I", len(b)) + b)
+    def _on_ready(self):
+        self._buf += bytes(self.proc.readAllStandardOutput())
+        while len(self._buf) >= 4:
+            n = struct.unpack(">I", self._buf[:4])[0]
+            if len(self._buf) < 4 + n: break
+            body, self._buf = self._buf[4:4+n], self._buf[4+n:]
+            job, self._current = self._current, None
+            if job is not None:
+                try: res = json.loads(body.decode("utf-8", "ignore"))
+                except Exception as e: res = {"rc": 1, "out": "", "err": f"worker frame error: {e}"}
+                job.deliver(res)
+        self._next()
+    def _on_exit(self, code, _status):
+        # 実行中に落ちたらその要求は失敗扱い。残りは次の _next で再起動して続ける
+        job, self._current = self._current, None
+        if job is not None: job.deliver({"rc": code or 1, "out": "", "err": f"worker exited: {code}"})
+        self._next()
+
+class WorkerJob(QObject):
+    """ProcRunner と同じシグナルを持つ、常駐ワーカーへの実行要求"""
+    finished_ok  = pyqtSignal(str)
+    finished_err = pyqtSignal(str)
+    def __init__(self, worker: ScriptWorker, script: str, stdin_text: str = ""):
+        super().__init__(worker)
+        self.worker = worker; self.script = script; self.stdin_text = stdin_text
+    def start(self): self.worker.submit(self)
+    def deliver(self, res: dict):
+        out = res.get("out") or ""; err = res.get("err") or ""; rc = res.get("rc", 1)
+        if rc != 0: self.finished_err.emit((err + "\n" + out).strip() or f"returncode:{rc}")
+        else:       self.finished_ok.emit(out.strip())
+        self.deleteLater()
+
 # ================ 無料AI（Ollama）承認/自動インストール ================
+@functools.lru_cache(maxsize=1)
+def _have_ollama() -> Optional[str]:
+    # PATH 走査は 1 回だけ（インストール直後は cache_clear して再判定）
+    return shutil.which("ollama")
+
+OLLAMA_SERVE_WAIT_SEC = 20.0  # `ollama serve` を起動してから /api/tags の応答を待つ上限（秒）
+
+def ollama_tags(timeout: float = 1.5) -> Optional[List[str]]:
+    """常駐中の Ollama から取得済みモデル名を返す。デーモンに届かなければ None"""
+    import urllib.request
+    host = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434").rstrip("/")
+    deadline = time.time() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f"{host}/api/tags", timeout=max(0.2, min(1.5, deadline - time.time()))) as r:
+                js = json_loads_bytes(r.read())
+            return [str(m.get("name","")) for m in (js.get("models") or []) if m.get("name")]
+        except Exception:
+            if time.time() >= deadline: return None
+            time.sleep(0.25)
+
+class OllamaProbe(QThread):
+    """ollama_tags をワーカースレッドで実行する（デーモン未起動時の再試行待ちで GUI を止めない）。結果はモデル名の list か None"""
+    finished_ok = pyqtSignal(object)
+    def __init__(self, timeout: float = 1.5):
+        super().__init__(); self.timeout = timeout
+    def run(self):
+        try: names = ollama_tags(self.timeout)
+        except Exception: names = None
+        self.finished_ok.emit(names)
+
 class OllamaConsentDialog(QDialog):
     def __init__(self, parent=None, model_name="qwen2.5:7b-instruct"):
         super().__init__(parent)
@@ -229,6 +389,54 @@ class OllamaConsentDialog(QDialog):
         lay = QVBoxLayout(self); lay.addWidget(title); lay.addWidget(lbl); lay.addWidget(self.chk_pull); lay.addWidget(self.btns)
 
 # ================ Excel 閲覧ダイアログ ================
+class ExcelRowSource:
+    """read_only ワークブックから表示に必要な行だけをブロック単位で読み出す（全セルはメモリに持たない）"""
+    BLOCK = 256; MAX_BLOCKS = 16
+    def __init__(self, ws, ncols: int, row_numbers: List[int]):
+        self.ws = ws; self.ncols = ncols; self.row_numbers = row_numbers
+        self._blocks: "OrderedDict[int, List[List[str]]]" = OrderedDict()
+    def __len__(self): return len(self.row_numbers)
+    def _cells(self, r) -> List[str]:
+        # 文字列セルが大半なので str() を呼ぶのは数値など非文字列だけ
+        vals = [v if v.__class__ is str else ("" if v is None else str(v)) for v in (r or ())[:self.ncols]]
+        if len(vals) < self.ncols: vals += [""] * (self.ncols - len(vals))
+        return vals
+    def _load_block(self, b: int) -> List[List[str]]:
+        nums = self.row_numbers[b*self.BLOCK:(b+1)*self.BLOCK]
+        if not nums: return []
+        want = set(nums); got: Dict[int, List[str]] = {}
+        for n, r in enumerate(self.ws.iter_rows(min_row=nums[0], max_row=nums[-1], values_only=True), start=nums[0]):
+            if n in want: got[n] = self._cells(r)
+        return [got.get(n) or [""] * self.ncols for n in nums]
+    def row(self, i: int) -> List[str]:
+        b = i // self.BLOCK; blk = self._blocks.get(b)
+        if blk is None:
+            blk = self._blocks[b] = self._load_block(b)
+            while len(self._blocks) > self.MAX_BLOCKS: self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(b)
+        return blk[i - b*self.BLOCK]
+
+class RowsTableModel(QAbstractTableModel):
+    """行ソースをそのまま見せる読み取り専用モデル（表示中のセルだけ data() が呼ばれる）"""
+    def __init__(self, headers: List[str], source: ExcelRowSource, parent=None):
+        super().__init__(parent)
+        self._headers = headers; self._src = source; self._view: List[int] = list(range(len(source)))
+    def set_filter(self, idxs: Optional[List[int]]):
+        self.beginResetModel()
+        self._view = list(range(len(self._src))) if idxs is None else idxs
+        self.endResetModel()
+    def rowCount(self, parent=QModelIndex()):    return 0 if parent.isValid() else len(self._view)
+    def columnCount(self, parent=QModelIndex()): return 0 if parent.isValid() else len(self._headers)
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid(): return None
+        return self._src.row(self._view[index.row()])[index.column()]
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole: return None
+        if orientation == Qt.Horizontal:
+            return self._headers[section] if 0 <= section < len(self._headers) else None
+        return str(section + 1)
+
 class ExcelViewerDialog(QDialog):
     def __init__(self, parent: QWidget, xlsx_path: Path):
         super().__init__(parent)
@@ -241,34 +449,75 @@ class ExcelViewerDialog(QDialog):
         btn_open = QPushButton("エクスプローラで開く"); btn_open.clicked.connect(self._open_folder)
         topline.addWidget(QLabel(f"ファイル: {self.xlsx_path.as_posix()}")); topline.addStretch(1)
         topline.addWidget(self.search_box); topline.addWidget(btn_open); lay.addLayout(topline)
-        self.table = QTableWidget(); self.table.setEditTriggers(QAbstractItemView.NoEditTriggers); self.table.setFont(APP_FONT); lay.addWidget(self.table)
-        self.df_all: Optional['pd.DataFrame'] = None; self._load_excel(); self.search_box.textChanged.connect(self._apply_filter)
+        self.table = QTableView(); self.table.setEditTriggers(QAbstractItemView.NoEditTriggers); self.table.setFont(APP_FONT); lay.addWidget(self.table)
+        self.table.horizontalHeader().setResizeContentsPrecision(200)  # 列幅の自動調整は先頭 200 行だけ見る
+        self.model: Optional[RowsTableModel] = None
+        self._headers: List[str] = []; self._haystack: List[str] = []; self._wb = None
+        # 連続入力はまとめて 1 回だけ絞り込む（120ms デバウンス）
+        self._filter_timer = QTimer(self); self._filter_timer.setSingleShot(True); self._filter_timer.setInterval(120)
+        self._filter_timer.timeout.connect(self._do_apply_filter); self._applied_query: Optional[str] = None
+        # 走査は FILTER_SLICE 行ずつ 0ms タイマーで進め、合間に入力イベントを処理させる（入力が変われば途中で捨てる）
+        self._scan_timer = QTimer(self); self._scan_timer.setInterval(0); self._scan_timer.timeout.connect(self._scan_step)
+        self._scan: Optional[list] = None  # [検索語, トークン, 次の行, 一致した行番号]
+        self._load_excel(); self.search_box.textChanged.connect(self._on_search_changed)
     def _open_folder(self):
         path = self.xlsx_path.resolve().parent
-        if platform.system().lower().startswith("win"): os.startfile(str(path))
-        elif platform.system().lower().startswith("darwin"): subprocess.run(["open", str(path)])
+        if _SYS.startswith("win"): os.startfile(str(path))
+        elif _SYS.startswith("darwin"): subprocess.run(["open", str(path)])
         else: subprocess.run(["xdg-open", str(path)])
     def _load_excel(self):
+        # 閲覧専用なので openpyxl の read_only ストリーミングで読む。
+        # 1 周目で保持するのは検索用の小文字文字列と行番号だけで、表示セルは ExcelRowSource が必要時に読む
         try:
-            if pd is None:
-                raise RuntimeError("pandas が未導入のため表示できません。")
-            self.df_all = pd.read_excel(self.xlsx_path)
+            if not _have_openpyxl:
+                raise RuntimeError("openpyxl が未導入のため表示できません。")
+            import openpyxl  # type: ignore
+            wb = openpyxl.load_workbook(self.xlsx_path, read_only=True, data_only=True)
+            ws = wb.worksheets[0]
+            it = ws.iter_rows(values_only=True)
+            head = next(it, ()) or ()
+            headers = [("" if v is None else str(v)) or f"列{j+1}" for j, v in enumerate(head)]
+            ncols = len(headers); hay: List[str] = []; nums: List[int] = []
+            for n, r in enumerate(it, start=2):
+                if r is None or all(v is None for v in r): continue
+                nums.append(n)
+                hay.append(" \u0001 ".join("" if v is None else str(v) for v in r[:ncols]).lower())
         except Exception as e:
-            alert(self, "読込失敗", f"Excel の読み込みに失敗しました。\n{e}"); self.df_all = None; return
-        self._render_df(self.df_all)
-    def _apply_filter(self, text: str):
-        if self.df_all is None: return
-        t = (text or "").strip()
-        if not t: self._render_df(self.df_all); return
-        df = self.df_all[self.df_all.apply(lambda r: any(t.lower() in str(v).lower() for v in r.values), axis=1)]
-        self._render_df(df)
-    def _render_df(self, df: 'pd.DataFrame'):
-        self.table.clear(); self.table.setRowCount(len(df)); self.table.setColumnCount(len(df.columns))
-        self.table.setHorizontalHeaderLabels([str(c) for c in df.columns])
-        for i, (_, row) in enumerate(df.iterrows()):
-            for j, v in enumerate(row.values):
-                it = QTableWidgetItem("" if v is None else str(v)); self.table.setItem(i, j, it)
+            alert(self, "読込失敗", f"Excel の読み込みに失敗しました。\n{e}")
+            self._headers, self._haystack = [], []; return
+        self._wb = wb; self._headers, self._haystack = headers, hay
+        self.model = RowsTableModel(headers, ExcelRowSource(ws, ncols, nums), self); self.table.setModel(self.model)
         self.table.resizeColumnsToContents()
+    def done(self, r: int):
+        if self._wb is not None:
+            try: self._wb.close()
+            except Exception: pass
+            self._wb = None
+        super().done(r)
+    FILTER_SLICE = 5000  # 1 回のタイマー処理で調べる行数
+    def _on_search_changed(self, _t: str):
+        self._scan_timer.stop(); self._scan = None  # 走査中の古い検索語は打ち切る
+        self._filter_timer.start()
+    def _do_apply_filter(self):
+        # デバウンス後に最新の入力だけを処理。直前と同じ検索語なら何もしない
+        text = self.search_box.text()
+        if text == self._applied_query or self.model is None: return
+        toks = (text or "").lower().split()  # 空白区切りは AND 検索
+        if not toks:
+            self.model.set_filter(None); self._applied_query = text; return
+        self._scan = [text, toks, 0, []]; self._scan_timer.start()
+    def _scan_step(self):
+        st = self._scan
+        if st is None: self._scan_timer.stop(); return
+        text, toks, pos, idxs = st
+        end = min(pos + self.FILTER_SLICE, len(self._haystack)); hay = self._haystack
+        if len(toks) == 1:
+            t = toks[0]; idxs.extend(i for i in range(pos, end) if t in hay[i])
+        else:
+            idxs.extend(i for i in range(pos, end) if all(t in hay[i] for t in toks))
+        if end < len(hay): st[2] = end; return
+        self._scan_timer.stop(); self._scan = None
+        self.model.set_filter(idxs); self._applied_query = text
 
 # ================ スタイル ================
 def base_stylesheet() -> str:
@@ -276,7 +525,7 @@ def base_stylesheet() -> str:
     * { font-size: 18px; }
     QMainWindow, QWidget { background: #FFF7FA; color: #333; }
     QLabel { color:#333; }
-    QLineEdit, QTextEdit, QPlainTextEdit, QTableWidget, QTreeWidget {
+    QLineEdit, QTextEdit, QPlainTextEdit, QTableView, QTreeView {
         background: #FFFFFF; border: 1px solid #E9C7D5; border-radius: 8px; padding: 4px;
     }
     QPushButton {
@@ -293,6 +542,23 @@ def base_stylesheet() -> str:
     QToolBar { background: #FBE7F1; spacing: 8px; padding: 4px; border-bottom: 1px solid #E9C7D5; }
     """
 
+# ================ 結果ビュー（プレーンテキスト専用） ================
+RESULT_MAX_BLOCKS = 20000  # 読み取り専用ビューの行数上限（異常に長い出力で GUI メモリが膨らまないよう）
+
+def _new_result_view(read_only: bool = False) -> QPlainTextEdit:
+    # AI 出力は等幅のプレーンテキストのみなので、リッチテキスト用の QTextEdit は使わない
+    # 行数上限は読み取り専用ビューだけ（編集欄は toPlainText() を保存するので先頭を捨てられず、上限を付けると undo も効かなくなる）
+    te = QPlainTextEdit(); te.setFont(MONO_FONT)
+    if read_only: te.setReadOnly(True); te.setMaximumBlockCount(RESULT_MAX_BLOCKS)
+    return te
+
+def set_view_text(view: QPlainTextEdit, text: str) -> None:
+    # 大きな結果を流し込む間は再描画を止め、最後に 1 回だけ描き直す
+    view.setUpdatesEnabled(False)
+    try: view.setPlainText(text)
+    finally:
+        view.setUpdatesEnabled(True); view.viewport().update()
+
 # ================ S/O フォーム（2行入力） ================
 def _new_2line_editor(placeholder: str, parent_font: QFont) -> QPlainTextEdit:
     te = QPlainTextEdit(); te.setFont(parent_font); te.setPlaceholderText(placeholder)
@@ -318,16 +584,15 @@ class SFormWidget(QWidget):
         self.e_back      = add_row(7, "背景",        "例）過去の疾患、現在抱える問題")
         self.e_think     = add_row(8, "思考",        "例）患者の考えていること、宗教的思考など")
         self.e_etc       = add_row(9, "その他",      "自由記載（必要に応じて）")
+        # 出力順の (タグ, エディタ) 表は 1 回だけ組む
+        self._rows = (("主訴:", self.e_shuso), ("発症/経過:", self.e_keika), ("部位:", self.e_bui),
+                      ("性質/程度:", self.e_seishitsu), ("誘因/緩和:", self.e_inyo), ("随伴症状:", self.e_zuikan),
+                      ("生活/社会:", self.e_life), ("背景:", self.e_back), ("思考:", self.e_think), ("その他:", self.e_etc))
         lay = QVBoxLayout(self); lay.setSpacing(6); lay.addWidget(box)
     def _val(self, te: QPlainTextEdit) -> str: return te.toPlainText().strip()
     def compose_text(self) -> str:
         xs = ["S: 主観"]
-        def add(tag, te):
-            v = self._val(te)
-            if v: xs.append(f"{tag} {v}")
-        add("主訴:", self.e_shuso); add("発症/経過:", self.e_keika); add("部位:", self.e_bui)
-        add("性質/程度:", self.e_seishitsu); add("誘因/緩和:", self.e_inyo); add("随伴症状:", self.e_zuikan)
-        add("生活/社会:", self.e_life); add("背景:", self.e_back); add("思考:", self.e_think); add("その他:", self.e_etc)
+        xs.extend(f"{tag} {v}" for tag, te in self._rows if (v := te.toPlainText().strip()))
         return "\n".join(xs).strip()
 
 class OFormWidget(QWidget):
@@ -354,27 +619,77 @@ class OFormWidget(QWidget):
         self.e_high     = add_row(15,"身長",              "例）170cm")
         self.e_weight   = add_row(16,"体重",              "例）60kg")
         self.e_etc      = add_row(17,"その他",            "自由記載（デバイス、創部など）")
+        # バイタル（書式テンプレ）とその他所見の表は 1 回だけ組む。BP は SBP/DBP の組合せで別処理
+        self._vitals_pre  = (("T{}", self.e_T), ("HR{}", self.e_HR), ("RR{}", self.e_RR), ("SpO2 {}%", self.e_SpO2))
+        self._vitals_post = (("NRS {}", self.e_NRS),)
+        self._rows = (("名前・性別:", self.e_name), ("意識:", self.e_awareness), ("呼吸所見:", self.e_resp),
+                      ("循環/皮膚:", self.e_circ), ("排泄/水分:", self.e_excrete), ("検査:", self.e_lab),
+                      ("リスク指標:", self.e_risk), ("活動:", self.e_active), ("身長:", self.e_high),
+                      ("体重:", self.e_weight), ("その他:", self.e_etc))
         lay = QVBoxLayout(self); lay.setSpacing(6); lay.addWidget(box)
     def _val(self, te: QPlainTextEdit) -> str: return te.toPlainText().strip()
     def compose_text(self) -> str:
-        xs = ["O: 客観"]; vit = []
-        if self._val(self.e_T):    vit.append(f"T{self._val(self.e_T)}")
-        if self._val(self.e_HR):   vit.append(f"HR{self._val(self.e_HR)}")
-        if self._val(self.e_RR):   vit.append(f"RR{self._val(self.e_RR)}")
-        if self._val(self.e_SpO2): vit.append(f"SpO2 {self._val(self.e_SpO2)}%")
+        xs = ["O: 客観"]
+        vit = [fmt.format(v) for fmt, te in self._vitals_pre if (v := te.toPlainText().strip())]
         sbp = self._val(self.e_SBP); dbp = self._val(self.e_DBP)
         if sbp and dbp: vit.append(f"BP {sbp}/{dbp}")
         elif sbp:       vit.append(f"SBP {sbp}")
         elif dbp:       vit.append(f"DBP {dbp}")
-        if self._val(self.e_NRS): vit.append(f"NRS {self._val(self.e_NRS)}")
+        vit.extend(fmt.format(v) for fmt, te in self._vitals_post if (v := te.toPlainText().strip()))
         if vit: xs.append("バイタル: " + ", ".join(vit))
-        def add(tag, te):
-            v = self._val(te)
-            if v: xs.append(f"{tag} {v}")
-        add("名前・性別:", self.e_name);add("意識:", self.e_awareness); add("呼吸所見:", self.e_resp); add("循環/皮膚:", self.e_circ)
-        add("排泄/水分:", self.e_excrete); add("検査:", self.e_lab); add("リスク指標:", self.e_risk); add("活動:", self.e_active);add("身長:", self.e_high); add("体重:", self.e_weight);add("その他:", self.e_etc)
+        xs.extend(f"{tag} {v}" for tag, te in self._rows if (v := te.toPlainText().strip()))
         return "\n".join(xs).strip()
 
+# ================ 診断候補ツリー ================
+def _cand_rank(c: Dict[str, Any]) -> int:
+    try: return int(c.get("ai_rank", 999999))
+    except Exception: return 999999
+
+class CandidateModel(QAbstractTableModel):
+    """診断候補（dict のリスト）とチェック状態（bytearray）をそのまま持つモデル（行ごとの QObject を作らない）"""
+    HEADERS = ["選択","AI順位","スコア","Code","診断名"]
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows: List[Dict[str, Any]] = []; self._text: List[tuple] = []; self._rank: List[int] = []
+        self._checked = bytearray(); self.checked_count = 0  # チェック数は差分で更新（毎回数え直さない）
+    def set_rows(self, rows: List[Dict[str, Any]], ranks: Optional[List[int]] = None):
+        self.beginResetModel()
+        self._rows = rows; self._checked = bytearray(len(rows)); self.checked_count = 0
+        self._text = [("", str(c.get("ai_rank","")), f"{float(c.get('score',0)): .1f}".strip(), c.get("code",""), c.get("label",""))
+                      for c in rows]
+        self._rank = ranks if ranks is not None else [_cand_rank(c) for c in rows]  # 並べ替え用の数値順位（毎回 int() しない）
+        self.endResetModel()
+    def row_dict(self, r: int) -> Dict[str, Any]: return self._rows[r] if 0 <= r < len(self._rows) else {}
+    def rank(self, r: int) -> int: return self._rank[r]
+    def checked_rows(self) -> List[int]: return [r for r, v in enumerate(self._checked) if v]
+    def set_checked_rows(self, rows, exclusive: bool = False) -> None:
+        # まとめてチェックを付け、dataChanged は 1 回だけ（exclusive なら他は外す）
+        if not self._rows: return
+        if exclusive: self._checked = bytearray(len(self._rows)); self.checked_count = 0
+        for r in rows:
+            if not self._checked[r]: self._checked[r] = 1; self.checked_count += 1
+        self.dataChanged.emit(self.index(0, 0), self.index(len(self._rows) - 1, 0), [Qt.CheckStateRole])
+    def rowCount(self, parent=QModelIndex()):    return 0 if parent.isValid() else len(self._rows)
+    def columnCount(self, parent=QModelIndex()): return 0 if parent.isValid() else len(self.HEADERS)
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid(): return None
+        r, col = index.row(), index.column()
+        if role == Qt.DisplayRole: return self._text[r][col] or None
+        if role == Qt.CheckStateRole and col == 0: return Qt.Checked if self._checked[r] else Qt.Unchecked
+        return None
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.CheckStateRole or not index.isValid() or index.column() != 0: return False
+        r = index.row(); v = 1 if value == Qt.Checked else 0
+        if self._checked[r] == v: return False
+        self._checked[r] = v; self.checked_count += 1 if v else -1; self.dataChanged.emit(index, index, [Qt.CheckStateRole]); return True
+    def flags(self, index):
+        if not index.isValid(): return Qt.NoItemFlags
+        f = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        return f | Qt.ItemIsUserCheckable if index.column() == 0 else f
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or orientation != Qt.Horizontal: return None
+        return self.HEADERS[section] if 0 <= section < len(self.HEADERS) else None
+
 # ================ NurseApp ================
 class NurseApp(QMainWindow):
     def __init__(self):
@@ -410,20 +725,40 @@ class NurseApp(QMainWindow):
         self.th_assess = self.th_diag = self.th_record = self.th_plan = None
         self.th_ollama_pull = self.th_ollama_install = None
 
-        for fn in [ASSESS_RESULT_TXT, ASSESS_FINAL_TXT,
-                   DIAG_RESULT_TXT,  DIAG_FINAL_TXT,
-                   RECORD_RESULT_TXT, RECORD_FINAL_TXT,
-                   PLAN_RESULT_TXT,   PLAN_FINAL_TXT]:
-            ensure_file(fn)
+        # 生成スクリプトは常駐ワーカーで実行し、起動と import のコストを初回だけにする（配布版 exe は従来どおり毎回起動）
+        self.workers: Dict[str, ScriptWorker] = {}
+        if not getattr(sys, "frozen", False) and Path(WORKER_SCRIPT).exists():
+            for name in ("assessment.py", "diagnosis.py", "record.py", "careplan.py"):
+                self.workers[name] = w = ScriptWorker(_AI_ENV, self); w.warm()
+            QApplication.instance().aboutToQuit.connect(lambda: [w.stop() for w in self.workers.values()])
+
+        # 既存ファイルは 1 回の scandir でまとめて確認し、足りない分だけ GUI スレッド外で作る
+        needed = [ASSESS_RESULT_TXT, ASSESS_FINAL_TXT,
+                  DIAG_RESULT_TXT,  DIAG_FINAL_TXT,
+                  RECORD_RESULT_TXT, RECORD_FINAL_TXT,
+                  PLAN_RESULT_TXT,   PLAN_FINAL_TXT]
+        try:
+            with os.scandir(".") as it: existing = {e.name for e in it}
+        except OSError: existing = set()
+        missing = [fn for fn in needed if fn not in existing]
+        if missing:
+            def _touch_missing():
+                for fn in missing:
+                    try: Path(fn).touch(exist_ok=True)
+                    except OSError: pass
+            QThreadPool.globalInstance().start(_touch_missing)
 
         # 案内 & ローカルAI準備
         self.first_time_ai_banner()
         self.prepare_free_ai()
 
-        try:
-            self.user_excel_path = self.ensure_user_excel_copy()
-        except Exception as e:
-            self.user_excel_path = None; self.statusBar().showMessage(f"Excelコピーの準備に失敗: {e}", 5000)
+        # ユーザー用 Excel のコピーは起動を待たせないようワーカーで行う（閲覧時は同期で再確認）
+        if Path(NANDA_XLSX).exists():
+            self.user_excel_path = user_excel_dst()
+            QThreadPool.globalInstance().start(lambda: sync_user_excel(Path(NANDA_XLSX)))
+        else:
+            self.user_excel_path = None
+            self.statusBar().showMessage("nanda_db.xlsx が見つかりません。Excel閲覧はスキップされます。", 8000)
 
     # ---------- 設定の保存 ----------
     def _on_toggle_so_template(self, checked: bool):
@@ -436,11 +771,7 @@ class NurseApp(QMainWindow):
         src = Path(NANDA_XLSX)
         if not src.exists():
             self.statusBar().showMessage("nanda_db.xlsx が見つかりません。Excel閲覧はスキップされます。", 8000); return None
-        user = getpass.getuser() or "user"
-        dst = USER_XLSX_ROOT / user / "nanda_db.xlsx"; dst.parent.mkdir(parents=True, exist_ok=True)
-        need_copy = (not dst.exists()) or (src.stat().st_mtime > dst.stat().st_mtime)
-        if need_copy: shutil.copy2(src, dst)
-        return dst
+        return sync_user_excel(src)
 
     def open_excel_viewer(self):
         try:
@@ -453,20 +784,62 @@ class NurseApp(QMainWindow):
     # ---------- 無料AI（Ollama） ----------
     def prepare_free_ai(self):
         model = os.environ.get("AI_MODEL", "qwen2.5:7b-instruct")
-        if shutil.which("ollama") is None:
+        if _have_ollama() is None:
             dlg = OllamaConsentDialog(self, model_name=model)
             if dlg.exec_() != QDialog.Accepted:
                 info(self, "無料AIの設定", "Ollama の準備はスキップされました。後から自動案内します。"); return
             self._install_ollama_with_progress(); return
-        try:
-            cp = subprocess.run(["ollama","list"], capture_output=True, text=True, encoding="utf-8", errors="ignore")
-            out = (cp.stdout or "") + "\n" + (cp.stderr or ""); has_model = any(model in ln for ln in out.splitlines())
-        except Exception: has_model = False
+        # 常駐デーモンに HTTP で問い合わせる（毎回 `ollama list` を起動しない）。再試行待ちがあるのでワーカーで行い、結果で UI を更新する
+        self.statusBar().showMessage("無料AIモデルの状態を確認中…")
+        self.th_ollama_probe = OllamaProbe()
+        self.th_ollama_probe.finished_ok.connect(lambda names: self._after_ollama_probe(model, names))
+        self.th_ollama_probe.start()
+
+    def _after_ollama_probe(self, model: str, names: Optional[List[str]]):
+        if names is not None:
+            has_model = any(n == model or n.startswith(model + ":") or n.split(":")[0] == model for n in names)
+            self._after_ollama_check(model, has_model); return
+        # 未起動なら 1 回だけ serve を立て、/api/tags が応答するまで（上限付きで）待ってから取得要否を決める
+        # （起動直後に `ollama list` すると待ち受け前で「モデル無し」に見え、不要な pull を始めてしまう）
+        self._ensure_ollama_daemon()
+        if getattr(self, "_ollama_serve", None) is None:
+            self.statusBar().showMessage("Ollama を起動できませんでした。無料AIは使わずに続けます。", 8000); return
+        self.th_ollama_probe = OllamaProbe(OLLAMA_SERVE_WAIT_SEC)
+        self.th_ollama_probe.finished_ok.connect(lambda names: self._after_ollama_serve(model, names))
+        self.th_ollama_probe.start()
+
+    def _after_ollama_serve(self, model: str, names: Optional[List[str]]):
+        if names is None:
+            self.statusBar().showMessage("Ollama が応答しません。無料AIは使わずに続けます。", 8000); return
+        self._after_ollama_probe(model, names)
+
+    def _after_ollama_check(self, model: str, has_model: bool):
         if not has_model: self._pull_model_with_progress(model)
         else: self.statusBar().showMessage(f"無料AIモデル（{model}）は準備済みです。", 3000)
 
+    def _ensure_ollama_daemon(self):
+        # 既に常駐していれば何もしない。無ければ `ollama serve` をこのアプリの寿命だけ常駐させる
+        if getattr(self, "_ollama_serve", None) is not None and self._ollama_serve.poll() is None: return
+        try:
+            self._ollama_serve = subprocess.Popen(["ollama","serve"], stdin=subprocess.DEVNULL, env=_OLLAMA_SERVE_ENV,
+                                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            QApplication.instance().aboutToQuit.connect(self._stop_ollama_daemon)
+        except Exception:
+            self._ollama_serve = None
+
+    def _stop_ollama_daemon(self):
+        # 自分で起こした `ollama serve` だけを終了させる。固定時間は待たず、終わった時点で戻る
+        p = getattr(self, "_ollama_serve", None)
+        if p is None or p.poll() is not None: return
+        try:
+            p.terminate()
+            try: p.wait(timeout=2.0)
+            except subprocess.TimeoutExpired: p.kill(); p.wait(timeout=1.0)
+        except Exception:
+            pass
+
     def _install_ollama_with_progress(self):
-        sysname = platform.system().lower()
+        sysname = _SYS
         self.statusBar().showMessage("無料AI（Ollama）をインストールしています…")
         dlg = QProgressDialog("Ollama をインストール中…", None, 0, 0, self)
         dlg.setWindowModality(Qt.ApplicationModal); dlg.setCancelButton(None); dlg.setAutoClose(True)
@@ -491,7 +864,8 @@ class NurseApp(QMainWindow):
 
     def _ollama_install_ok(self, dlg: QProgressDialog, out: str):
         dlg.close(); self.statusBar().showMessage("Ollama のインストールが完了しました。", 5000); time.sleep(1.0)
-        if shutil.which("ollama") is None:
+        _have_ollama.cache_clear()
+        if _have_ollama() is None:
             alert(self,"Ollama 未検出","直後のため認識されていない可能性。アプリを再起動してください。"); return
         self._pull_model_with_progress(os.environ.get("AI_MODEL","qwen2.5:7b-instruct"))
 
@@ -570,7 +944,7 @@ class NurseApp(QMainWindow):
 
         # 下側（結果ビュー）
         bottom = QWidget(); blay = QVBoxLayout(bottom); blay.setSpacing(6)
-        self.assess_view = QTextEdit(); self.assess_view.setFont(MONO_FONT)
+        self.assess_view = _new_result_view()
         blay.addWidget(self.assess_view)
         self.assess_hint = QLabel("（アセスメント結果がここに表示されます）"); blay.addWidget(self.assess_hint)
 
@@ -591,11 +965,15 @@ class NurseApp(QMainWindow):
         self.o_stack.setCurrentIndex(1 if self.use_so_template else 0)
 
     # ---------- 診断候補 表示 ----------
-    def _build_diag_block(self, c: Dict[str,Any], idx: int) -> str:
-        lines = [f"{idx}. [{c.get('code','')}] {c.get('label','')}"]
-        if c.get("definition"): lines.append(f"    定義: {c['definition']}")
+    def _build_diag_block(self, c: Dict[str,Any], idx: int, out: Optional[List[str]] = None) -> str:
+        # out を渡すとそこへ直接積む（複数ブロックを 1 回の join で組み立てるため）
+        own = out is None
+        if own: out = []
+        ap = out.append
+        ap(f"{idx}. [{c.get('code','')}] {c.get('label','')}\n")
+        if c.get("definition"): ap(f"    定義: {c['definition']}\n")
         try:
-            lines.append(f"    AI順位: {int(c.get('ai_rank',0))} / AI類似度: {float(c.get('ai_sim',0.0)):.3f} / スコア: {float(c.get('score',0.0)):.1f}")
+            ap(f"    AI順位: {int(c.get('ai_rank',0))} / AI類似度: {float(c.get('ai_sim',0.0)):.3f} / スコア: {float(c.get('score',0.0)):.1f}\n")
         except Exception: pass
         if c.get("loose"):
             L = c["loose"]; buf=[]
@@ -603,31 +981,38 @@ class NurseApp(QMainWindow):
             if L.get("関連因子"): buf.append("関連因子: " + "・".join(L["関連因子"]))
             if L.get("危険因子"): buf.append("危険因子: " + "・".join(L["危険因子"]))
             if L.get("定義語"):   buf.append("定義語:   " + "・".join(L["定義語"]))
-            if buf: lines.append("    曖昧一致:"); [lines.append("      - " + b) for b in buf]
+            if buf:
+                ap("    曖昧一致:\n")
+                for b in buf: ap("      - "); ap(b); ap("\n")
         if c.get("reasons"):
-            lines.append("    スコア根拠:"); [lines.append("      - " + str(r)) for r in c["reasons"][:10]]
+            ap("    スコア根拠:\n")
+            for r in c["reasons"][:10]: ap("      - "); ap(str(r)); ap("\n")
         if c.get("ai_ev"):
-            lines.append("    AI根拠:"); [lines.append("      " + ln.strip()) for ln in str(c["ai_ev"]).splitlines() if ln.strip()]
+            ap("    AI根拠:\n")
+            for ln in str(c["ai_ev"]).splitlines():
+                ln = ln.strip()
+                if ln: ap("      "); ap(ln); ap("\n")
         meta_parts=[]
         def addm(j,k):
-            v=c.get(k,""); 
+            v=c.get(k,"")
             if v: meta_parts.append(f"{j}:{v}")
         addm("一次焦点","primary_focus"); addm("二次焦点","secondary_focus"); addm("ケア対象","care_target")
         addm("解剖学的部位","anatomical_site"); addm("年齢下限","age_min"); addm("年齢上限","age_max")
         addm("臨床経過","clinical_course"); addm("診断の状態","diagnosis_state"); addm("状況的制約","situational_constraints")
         addm("領域","domain"); addm("分類","class"); addm("判断","judge")
-        if meta_parts: lines.append("    メタ情報: " + " / ".join(meta_parts))
-        return "\n".join(lines)
+        if meta_parts: ap("    メタ情報: " + " / ".join(meta_parts) + "\n")
+        return "".join(out).rstrip("\n") if own else ""
 
     def _update_diag_view_from_checks(self):
-        selected_items = [it for it in self._iter_items() if it.checkState(0) == Qt.Checked]
-        if not selected_items:
-            self.diag_view.setPlainText("（候補のチェックを入れると、ここに選択内容のみが表示されます）"); return
-        selected_items.sort(key=lambda it: int(it.text(1) or "999999"))
-        blocks = []
-        for i, it in enumerate(selected_items, start=1):
-            c = it.data(0, Qt.UserRole) or {}; blocks.append(self._build_diag_block(c, i))
-        self.diag_view.setPlainText("\n\n".join(blocks))
+        m = self.cand_model; selected = m.checked_rows()
+        if not selected:
+            set_view_text(self.diag_view, "（候補のチェックを入れると、ここに選択内容のみが表示されます）"); return
+        selected.sort(key=lambda r: (m.rank(r), r))
+        out: List[str] = []
+        for i, r in enumerate(selected, start=1):
+            if i > 1: out.append("\n")
+            self._build_diag_block(m.row_dict(r), i, out)
+        set_view_text(self.diag_view, "".join(out).rstrip("\n"))
 
     # ---------- Tab: 診断 ----------
     def _tab_diagnosis(self) -> QWidget:
@@ -645,25 +1030,30 @@ class NurseApp(QMainWindow):
 
         split = QSplitter(Qt.Horizontal)
 
-        self.tree = QTreeWidget()
-        self.tree.setHeaderLabels(["選択","AI順位","スコア","Code","診断名"])
+        self.cand_model = CandidateModel(self)
+        self.tree = QTreeView(); self.tree.setModel(self.cand_model); self.tree.setRootIsDecorated(False)
+        self.tree.setSelectionBehavior(QAbstractItemView.SelectRows); self.tree.setSelectionMode(QAbstractItemView.SingleSelection)
         self.tree.header().setSectionResizeMode(QHeaderView.Interactive)
         self.tree.header().resizeSection(0, 80); self.tree.header().resizeSection(1, 80)
         self.tree.header().resizeSection(2, 90); self.tree.header().resizeSection(3, 100)
         self.tree.header().setStretchLastSection(True)
-        self.tree.itemSelectionChanged.connect(self._on_item_selected)
-        self.tree.itemChanged.connect(self._on_item_changed)
+        self.tree.setUniformRowHeights(True)
+        self.tree.selectionModel().selectionChanged.connect(self._on_item_selected)
+        self.cand_model.dataChanged.connect(self._on_item_changed)
+        # 連続したチェック操作は 1 回の再構築にまとめる
+        self._diag_view_timer = QTimer(self); self._diag_view_timer.setSingleShot(True); self._diag_view_timer.setInterval(50)
+        self._diag_view_timer.timeout.connect(self._update_diag_view_from_checks)
         split.addWidget(self.tree)
 
         right = QWidget(); rlay = QVBoxLayout(right)
-        self.detail = QTextEdit(); self.detail.setFont(MONO_FONT); self.detail.setReadOnly(True)
+        self.detail = _new_result_view(read_only=True)
         rlay.addWidget(QLabel("候補の詳細（選択中の1件）")); rlay.addWidget(self.detail)
         split.addWidget(right)
 
         split.setStretchFactor(0,3); split.setStretchFactor(1,2)
         outer.addWidget(split)
 
-        self.diag_view = QTextEdit(); self.diag_view.setFont(MONO_FONT)
+        self.diag_view = _new_result_view()
         self.diag_view.setPlaceholderText("（候補のチェックを入れると、ここに“選択中のみ”が表示されます）")
         outer.addWidget(self.diag_view)
 
@@ -674,41 +1064,38 @@ class NurseApp(QMainWindow):
         return w
 
     def load_candidates_into_table(self):
-        self.tree.clear(); p = Path(DIAG_JSON)
+        self.cand_model.set_rows([]); p = Path(DIAG_JSON)
         if not p.exists():
-            self.detail.setPlainText("（候補JSONがありません。診断を作成してください）"); return
-        try: data = json.loads(read_text_safe(p))
+            set_view_text(self.detail, "（候補JSONがありません。診断を作成してください）"); return
+        try: data = json_loads_bytes(p.read_bytes())
         except Exception as e:
-            self.detail.setPlainText(f"候補JSONの読込に失敗: {e}"); return
+            set_view_text(self.detail, f"候補JSONの読込に失敗: {e}"); return
         cands: List[Dict[str, Any]] = data.get("candidates", [])
-        cands.sort(key=lambda x: (int(x.get("ai_rank", 999999)), -float(x.get("ai_sim", 0))), reverse=False)
-        for _, c in enumerate(cands, start=1):
-            item = QTreeWidgetItem(self.tree)
-            item.setFlags(item.flags() | Qt.ItemIsUserCheckable | Qt.ItemIsSelectable | Qt.ItemIsEnabled)
-            item.setCheckState(0, Qt.Unchecked)
-            item.setText(1, str(c.get("ai_rank",""))); item.setText(2, f"{float(c.get('score',0)): .1f}".strip())
-            item.setText(3, c.get("code","")); item.setText(4, c.get("label",""))
-            item.setData(0, Qt.UserRole, c)
+        # 型変換は 1 件 1 回だけ（decorate-sort-undecorate）。順位はそのままモデルへ渡す
+        keyed = []
+        for c in cands:
+            try: sim = float(c.get("ai_sim", 0))
+            except Exception: sim = 0.0
+            keyed.append((_cand_rank(c), -sim, c))
+        keyed.sort(key=lambda k: (k[0], k[1]))
+        # モデルにリストごと渡して 1 回のリセットで反映（行ごとのアイテム生成・挿入なし）
+        self.cand_model.set_rows([k[2] for k in keyed], [k[0] for k in keyed])
 
     def _on_item_selected(self):
-        items = self.tree.selectedItems()
-        if not items: self.detail.clear(); return
-        c = items[0].data(0, Qt.UserRole) or {}; self.detail.setPlainText(self._build_diag_block(c, 1))
+        rows = self.tree.selectionModel().selectedRows()
+        if not rows: self.detail.clear(); return
+        c = self.cand_model.row_dict(rows[0].row()); set_view_text(self.detail, self._build_diag_block(c, 1))
 
-    def _on_item_changed(self, item: QTreeWidgetItem, col: int):
-        checked = sum(1 for i in self._iter_items() if i.checkState(0) == Qt.Checked)
-        self.statusBar().showMessage(f"選択中: {checked} 件", 2000); self._update_diag_view_from_checks()
-
-    def _iter_items(self):
-        for i in range(self.tree.topLevelItemCount()): yield self.tree.topLevelItem(i)
+    def _on_item_changed(self, *_):
+        self.statusBar().showMessage(f"選択中: {self.cand_model.checked_count} 件", 2000); self._diag_view_timer.start()
 
     def select_top_n(self):
         n, ok = QInputDialog.getInt(self, "AI上位の一括選択", "いくつ選びますか？", 3, 1, 50, 1)
         if not ok: return
-        items = [self.tree.topLevelItem(i) for i in range(self.tree.topLevelItemCount())]
-        items.sort(key=lambda it: int(it.text(1) or "9999"))
-        for i, it in enumerate(items): it.setCheckState(0, Qt.Checked if i < n else it.checkState(0))
-        self.statusBar().showMessage(f"AI上位 {n} 件を選択しました。", 3000); self._update_diag_view_from_checks()
+        m = self.cand_model
+        # 上位 N 件だけをチェックした状態にする（以前のチェックは残さない）
+        m.set_checked_rows(sorted(range(m.rowCount()), key=m.rank)[:n], exclusive=True)
+        self.statusBar().showMessage(f"AI上位 {n} 件を選択しました。", 3000)
 
     def save_diagnosis_final_from_checks(self):
         t = self.diag_view.toPlainText().strip()
@@ -716,6 +1103,15 @@ class NurseApp(QMainWindow):
             alert(self, "保存できません", "保存対象の本文が空です。候補にチェックを入れてください。"); return
         write_text_safe(Path(DIAG_FINAL_TXT), t + "\n"); info(self, "保存しました", f"{DIAG_FINAL_TXT} に保存しました。")
 
+    def _script_job(self, script_py: str, exe_name: str, stdin_text: str = ""):
+        # ProcRunner と同じ finished_ok / finished_err / start() を持つジョブを返す
+        w = self.workers.get(script_py)
+        job = WorkerJob(w, script_py, stdin_text) if w is not None else \
+              ProcRunner(_cmd_for(script_py, exe_name), stdin_text=stdin_text, env=_AI_ENV)
+        # 結果ファイルは書き直されたばかりなので、呼び出し側の処理より先に読み込みキャッシュを捨てる（接続順に呼ばれる）
+        job.finished_ok.connect(lambda _s: _READ_CACHE.clear()); job.finished_err.connect(lambda _s: _READ_CACHE.clear())
+        return job
+
     # ================= アセスメント処理 =================
     def run_assessment(self):
         if self.busy: alert(self,"実行中","他の処理が実行中です。終了をお待ちください。"); return
@@ -727,15 +1123,7 @@ class NurseApp(QMainWindow):
             alert(self, "入力不足", "S または O を入力してください。"); return
         self.busy = True; self.statusBar().showMessage("アセスメントを作成中…")
         payload = s + "\n<<<SEP>>>\n" + o
-        cmd = _cmd_for("assessment.py", "assessment.exe")
-        # 子プロセスにも OpenAI を無効化した環境を**強制**注入
-        env_over = {
-            "AI_PROVIDER": "ollama",
-            "OLLAMA_HOST": "http://127.0.0.1:11434",
-            "OPENAI_API_KEY": "",
-            "AI_LOG_DISABLE": "1",
-        }
-        self.th_assess = ProcRunner(cmd, stdin_text=payload, env_overrides=env_over)
+        self.th_assess = self._script_job("assessment.py", "assessment.exe", payload)
         self.th_assess.finished_ok.connect(self._assess_ok); self.th_assess.finished_err.connect(self._assess_err)
         self.th_assess.start()
 
@@ -743,20 +1131,20 @@ class NurseApp(QMainWindow):
         self.busy = False; self.statusBar().clearMessage()
         p = Path(ASSESS_RESULT_TXT)
         text = read_text_safe(p) or out or f"（{ASSESS_RESULT_TXT} は未作成/空です）"
-        self.assess_view.setPlainText(dedupe(text))
+        set_view_text(self.assess_view, dedupe(text))
         self.assess_hint.setText(f"（編集して「確定（保存）」を押すと {ASSESS_FINAL_TXT} に保存されます）")
 
     def _assess_err(self, err: str):
         self.busy = False; self.statusBar().clearMessage()
         p = Path(ASSESS_RESULT_TXT); fallback = read_text_safe(p)
         alert(self, "アセスメント作成に失敗", f"{err}\n（それでも {ASSESS_RESULT_TXT} があれば表示します）")
-        if fallback: self.assess_view.setPlainText(dedupe(fallback))
-        else:        self.assess_view.setPlainText(f"（{ASSESS_RESULT_TXT} は未作成/空です）")
+        if fallback: set_view_text(self.assess_view, dedupe(fallback))
+        else:        set_view_text(self.assess_view, f"（{ASSESS_RESULT_TXT} は未作成/空です）")
 
     def show_assessment_result(self):
         p = Path(ASSESS_RESULT_TXT)
         t = read_text_safe(p) or f"（{ASSESS_RESULT_TXT} は未作成/空です）"
-        self.assess_view.setPlainText(dedupe(t))
+        set_view_text(self.assess_view, dedupe(t))
 
     def save_assessment_final(self):
         t = self.assess_view.toPlainText().strip()
@@ -767,53 +1155,39 @@ class NurseApp(QMainWindow):
     def run_diagnosis(self):
         if self.busy: alert(self,"実行中","他の処理が実行中です。"); return
         self.busy = True; self.statusBar().showMessage("診断を作成中…")
-        cmd = _cmd_for("diagnosis.py", "diagnosis.exe")
-        env_over = {
-            "AI_PROVIDER": "ollama",
-            "OLLAMA_HOST": "http://127.0.0.1:11434",
-            "OPENAI_API_KEY": "",
-            "AI_LOG_DISABLE": "1",
-        }
-        self.th_diag = ProcRunner(cmd, env_overrides=env_over)
+        self.th_diag = self._script_job("diagnosis.py", "diagnosis.exe")
         self.th_diag.finished_ok.connect(self._diag_ok); self.th_diag.finished_err.connect(self._diag_err); self.th_diag.start()
 
     def _diag_ok(self, out: str):
         self.busy = False; self.statusBar().clearMessage()
         ptxt = Path(DIAG_RESULT_TXT)
         text = read_text_safe(ptxt) or out or f"（{DIAG_RESULT_TXT} は未作成/空です）"
-        self.diag_view.setPlainText(dedupe(text))
+        set_view_text(self.diag_view, dedupe(text))
         self.load_candidates_into_table(); self._update_diag_view_from_checks()
 
     def _diag_err(self, err: str):
         self.busy = False; self.statusBar().clearMessage()
         ptxt = Path(DIAG_RESULT_TXT); fallback = read_text_safe(ptxt)
         alert(self, "診断作成に失敗", f"{err}\n（それでも {DIAG_RESULT_TXT} があれば表示します）")
-        if fallback: self.diag_view.setPlainText(dedupe(fallback))
-        else:        self.diag_view.setPlainText(f"（{DIAG_RESULT_TXT} は未作成/空です）")
+        if fallback: set_view_text(self.diag_view, dedupe(fallback))
+        else:        set_view_text(self.diag_view, f"（{DIAG_RESULT_TXT} は未作成/空です）")
 
     def show_diagnosis_result_text(self):
         p = Path(DIAG_RESULT_TXT)
         t = read_text_safe(p) or f"（{DIAG_RESULT_TXT} は未作成/空です）"
-        self.diag_view.setPlainText(dedupe(t))
+        set_view_text(self.diag_view, dedupe(t))
 
     # ================= 記録処理 =================
     def run_record(self):
         if self.busy: alert(self,"実行中","他の処理が実行中です。"); return
         self.busy = True; self.statusBar().showMessage("記録を作成中…")
-        cmd = _cmd_for("record.py", "record.exe")
-        env_over = {
-            "AI_PROVIDER": "ollama",
-            "OLLAMA_HOST": "http://127.0.0.1:11434",
-            "OPENAI_API_KEY": "",
-            "AI_LOG_DISABLE": "1",
-        }
-        self.th_record = ProcRunner(cmd, env_overrides=env_over)
+        self.th_record = self._script_job("record.py", "record.exe")
         self.th_record.finished_ok.connect(self._record_ok); self.th_record.finished_err.connect(self._record_err); self.th_record.start()
 
     def _record_ok(self, out: str):
         self.busy = False; self.statusBar().clearMessage()
         p = Path(RECORD_RESULT_TXT); text = read_text_safe(p) or out or f"（{RECORD_RESULT_TXT} は未作成/空です）"
-        self.record_view.setPlainText(dedupe(text))
+        set_view_text(self.record_view, dedupe(text))
         # ヒント更新のみ（新しい QLabel を作らない）
         self.record_hint.setText(f"（編集して「確定（保存）」を押すと {RECORD_FINAL_TXT} に保存されます）")
 
@@ -821,13 +1195,13 @@ class NurseApp(QMainWindow):
         self.busy = False; self.statusBar().clearMessage()
         p = Path(RECORD_RESULT_TXT); fallback = read_text_safe(p)
         alert(self, "記録の作成に失敗", f"{err}\n（それでも {RECORD_RESULT_TXT} があれば表示します）")
-        if fallback: self.record_view.setPlainText(dedupe(fallback))
-        else:        self.record_view.setPlainText(f"（{RECORD_RESULT_TXT} は未作成/空です）")
+        if fallback: set_view_text(self.record_view, dedupe(fallback))
+        else:        set_view_text(self.record_view, f"（{RECORD_RESULT_TXT} は未作成/空です）")
 
     def show_record_result(self):
         p = Path(RECORD_RESULT_TXT)
         t = read_text_safe(p) or f"（{RECORD_RESULT_TXT} は未作成/空です）"
-        self.record_view.setPlainText(dedupe(t))
+        set_view_text(self.record_view, dedupe(t))
 
     def save_record_final(self):
         t = self.record_view.toPlainText().strip()
@@ -835,13 +1209,7 @@ class NurseApp(QMainWindow):
         write_text_safe(Path(RECORD_RESULT_TXT), t)
         self.statusBar().showMessage("記録を確定（review）しています…")
         cmd = _cmd_for("record_review.py", "record_review.exe")
-        env_over = {
-            "AI_PROVIDER": "ollama",
-            "OLLAMA_HOST": "http://127.0.0.1:11434",
-            "OPENAI_API_KEY": "",
-            "AI_LOG_DISABLE": "1",
-        }
-        th = ProcRunner(cmd, stdin_text=t, env_overrides=env_over)
+        th = ProcRunner(cmd, stdin_text=t, env=_AI_ENV)
         th.finished_ok.connect(lambda out: (self.statusBar().clearMessage(), info(self,"保存しました", f"{RECORD_FINAL_TXT} に保存しました。")))
         th.finished_err.connect(lambda err: (self.statusBar().clearMessage(), alert(self,"確定に失敗", f"{err}\n（編集内容は {RECORD_RESULT_TXT} に保存済みです）")))
         th.start()
@@ -857,7 +1225,7 @@ class NurseApp(QMainWindow):
         self.btn_record_save = QPushButton("確定（保存）")
         for b in (self.btn_record_run, self.btn_record_show, self.btn_record_save): btns.addWidget(b)
         lay.addLayout(btns)
-        self.record_view = QTextEdit(); self.record_view.setFont(MONO_FONT); lay.addWidget(self.record_view)
+        self.record_view = _new_result_view(); lay.addWidget(self.record_view)
         self.record_hint = QLabel("（record.py の出力がここに表示されます。編集後に「確定（保存）」）"); lay.addWidget(self.record_hint)
         self.btn_record_run.clicked.connect(self.run_record)
         self.btn_record_show.clicked.connect(self.show_record_result)
@@ -873,7 +1241,7 @@ class NurseApp(QMainWindow):
         self.btn_plan_save = QPushButton("確定（保存）")
         for b in (self.btn_plan_run, self.btn_plan_show, self.btn_plan_save): btns.addWidget(b)
         lay.addLayout(btns)
-        self.plan_view = QTextEdit(); self.plan_view.setFont(MONO_FONT); lay.addWidget(self.plan_view)
+        self.plan_view = _new_result_view(); lay.addWidget(self.plan_view)
         self.plan_hint = QLabel("（看護計画がここに表示されます）"); lay.addWidget(self.plan_hint)
         self.btn_plan_run.clicked.connect(self.run_careplan)
         self.btn_plan_show.clicked.connect(self.show_careplan_result)
@@ -883,31 +1251,24 @@ class NurseApp(QMainWindow):
     def run_careplan(self):
         if self.busy: alert(self,"実行中","他の処理が実行中です。"); return
         self.busy = True; self.statusBar().showMessage("看護計画を作成中…")
-        cmd = _cmd_for("careplan.py", "careplan.exe")
-        env_over = {
-            "AI_PROVIDER": "ollama",
-            "OLLAMA_HOST": "http://127.0.0.1:11434",
-            "OPENAI_API_KEY": "",
-            "AI_LOG_DISABLE": "1",
-        }
-        self.th_plan = ProcRunner(cmd, env_overrides=env_over)
+        self.th_plan = self._script_job("careplan.py", "careplan.exe")
         self.th_plan.finished_ok.connect(self._plan_ok); self.th_plan.finished_err.connect(self._plan_err); self.th_plan.start()
 
     def _plan_ok(self, out: str):
         self.busy = False; self.statusBar().clearMessage()
         p = Path(PLAN_RESULT_TXT); text = read_text_safe(p) or out or f"（{PLAN_RESULT_TXT} は未作成/空です）"
-        self.plan_view.setPlainText(dedupe(text)); self.plan_hint.setText(f"（編集して「確定（保存）」を押すと {PLAN_FINAL_TXT} に保存されます）")
+        set_view_text(self.plan_view, dedupe(text)); self.plan_hint.setText(f"（編集して「確定（保存）」を押すと {PLAN_FINAL_TXT} に保存されます）")
 
     def _plan_err(self, err: str):
         self.busy = False; self.statusBar().clearMessage()
         p = Path(PLAN_RESULT_TXT); fallback = read_text_safe(p)
         alert(self, "計画作成に失敗", f"{err}\n（それでも {PLAN_RESULT_TXT} があれば表示します）")
-        if fallback: self.plan_view.setPlainText(dedupe(fallback))
-        else:        self.plan_view.setPlainText(f"（{PLAN_RESULT_TXT} は未作成/空です）")
+        if fallback: set_view_text(self.plan_view, dedupe(fallback))
+        else:        set_view_text(self.plan_view, f"（{PLAN_RESULT_TXT} は未作成/空です）")
 
     def show_careplan_result(self):
         p = Path(PLAN_RESULT_TXT); t = read_text_safe(p) or f"（{PLAN_RESULT_TXT} は未作成/空です）"
-        self.plan_view.setPlainText(dedupe(t))
+        set_view_text(self.plan_view, dedupe(t))
 
     def save_careplan_final(self):
         t = self.plan_view.toPlainText().strip()
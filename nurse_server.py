@@ -3,10 +3,13 @@
 nurse_server.py — ローカルWebサーバ（UI/API/静的配信）
 起動:  python nurse_server.py --port 8787
 """
-import os, json, threading, argparse, re, runpy, io, sys, time, mimetypes
+import os, json, threading, argparse, io, sys, time, mimetypes, functools, multiprocessing, hashlib, shutil, builtins, types, gzip, tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
 from pathlib import Path
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import urlparse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from email.utils import formatdate
 
 # 実行ディレクトリ固定
 APP_DIR = Path(__file__).resolve().parent
@@ -34,133 +37,385 @@ PLAN_RESULT_TXT   = "careplan_result.txt"
 PLAN_FINAL_TXT    = "careplan_final.txt"
 NANDA_XLSX        = "nanda_db.xlsx"
 
+# orjson（任意）: bytes を直接出し入れして str 経由のエンコード/デコードを省く
+try:
+    import orjson as _orjson
+    def _json_dumps(obj) -> bytes: return _orjson.dumps(obj)
+    def _json_loads(b: bytes): return _orjson.loads(b)
+except Exception:
+    def _json_dumps(obj) -> bytes: return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+    def _json_loads(b: bytes): return json.loads(b)  # bytes のまま渡す（UTF-8 を自動判別、str への変換を 1 回省く）
+
 TASKS = { "assessment": {}, "diagnosis": {}, "record": {}, "careplan": {} }
 LOCK = threading.Lock()
+COND = threading.Condition(LOCK)  # TASKS 更新の通知（/status のロングポーリング用）
+STATUS_WAIT_SEC = 25
+_SEQ = 0
+# /status 応答の JSON は状態が変わったときだけ作る（ポーリングのたびにエンコードしない）
+# 値は (JSON, gzip 版|None, ETag) の組で差し替える（読み手はロック無しでも一貫したスナップショットを得る）
+# ETag は「起動 ID + 世代番号」。再起動で番号が振り直されても古いキャッシュと一致しない
+_BOOT_ID = f"{os.getpid():x}{time.time_ns():x}"
+_STATUS_IDLE = (_json_dumps({"running": False, "done": False, "seq": 0}), None, f'"{_BOOT_ID}-0"')
+_STATUS_BYTES: dict[str, tuple[bytes, bytes|None, str]] = {}
+# 中身が変わらない応答は起動時に 1 回だけ bytes にしておく
+_OK_JSON        = _json_dumps({"ok": True})
+_NOT_FOUND_JSON = _json_dumps({"ok": False, "error": "not found"})
+STATUS_KEYS = ("assessment", "diagnosis", "record", "careplan")  # /status_all で返す順
+GZIP_MIN_BYTES = 1024  # 結果本文を含む大きめの応答だけ、低圧縮(1)の gzip 版も作っておく
+
+def _bump(name):
+    # LOCK 保持中に呼ぶ: 状態の世代番号を進め、応答バイト列を作り直して待機中の /status を起こす
+    global _SEQ
+    _SEQ += 1; TASKS[name]["seq"] = _SEQ
+    b = _json_dumps(TASKS[name])
+    _STATUS_BYTES[name] = (b, gzip.compress(b, 1) if len(b) >= GZIP_MIN_BYTES else None, f'"{_BOOT_ID}-{_SEQ}"')
+    COND.notify_all()
+
+# ---------- Ollama 呼び出し（urllib3 があれば接続をプールして使い回す） ----------
+try:
+    import urllib3
+    _OLLAMA_POOL = urllib3.PoolManager(num_pools=2, maxsize=8, block=False, retries=urllib3.Retry(1))
+except Exception:
+    _OLLAMA_POOL = None
+
+OLLAMA_CONNECT_TIMEOUT = 3.0  # 接続できないときは生成の待ち時間を待たずにすぐ諦める
+
+def _ollama_post(url: str, payload: bytes, timeout: float) -> bytes:
+    if _OLLAMA_POOL is not None:
+        r = _OLLAMA_POOL.request("POST", url, body=payload, headers={"Content-Type":"application/json"},
+                                 timeout=urllib3.Timeout(connect=OLLAMA_CONNECT_TIMEOUT, read=timeout), preload_content=True)
+        if r.status >= 400: raise RuntimeError(f"HTTP {r.status}")
+        return r.data
+    import urllib.request
+    req = urllib.request.Request(url, data=payload, headers={"Content-Type":"application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as r:
+        return r.read()
+
+def _ollama_stream(url: str, payload: bytes, timeout: float):
+    # stream:true の NDJSON を 1 行ずつ dict で返す。timeout は行ごとの読み取り待ち。
+    # 途中で読むのをやめた場合は接続を閉じる（Ollama 側の生成も打ち切られる）
+    if _OLLAMA_POOL is not None:
+        r = _OLLAMA_POOL.request("POST", url, body=payload, headers={"Content-Type":"application/json"},
+                                 timeout=urllib3.Timeout(connect=OLLAMA_CONNECT_TIMEOUT, read=timeout), preload_content=False)
+    else:
+        import urllib.request
+        r = urllib.request.urlopen(urllib.request.Request(url, data=payload, headers={"Content-Type":"application/json"}), timeout=timeout)
+    done = False
+    try:
+        if r.status >= 400: raise RuntimeError(f"HTTP {r.status}")
+        for line in r:
+            if not line.strip(): continue
+            chunk = _json_loads(line)
+            if chunk.get("error"): raise RuntimeError(str(chunk["error"]))
+            yield chunk
+            if chunk.get("done"): done = True; break
+    finally:
+        if not done: r.close()
+        if _OLLAMA_POOL is not None: r.release_conn()
+        else: r.close()
 
 # ---------- 速度対策 1: Ollama を事前ウォーム ----------
-def _warm_ollama():
+def _warm_ollama(keep_alive: str = "24h"):
     try:
-        import json as _json, urllib.request
+        import json as _json
         host  = os.environ.get("OLLAMA_HOST","http://127.0.0.1:11434").rstrip("/")
         model = os.environ.get("AI_MODEL","qwen2.5:7b-instruct")
         payload = _json.dumps({
-            "model": model, "prompt": "ok",
-            "stream": False, "keep_alive": "24h",
-            "options": {"temperature": 0}
+            "model": model,  # 起動時に S/O 割付の system 部分の KV キャッシュも作っておく
+            "messages": [{"role": "system", "content": MAP_SO_SYSTEM}, {"role": "user", "content": "ok"}],
+            "stream": False, "keep_alive": keep_alive,
+            "options": {"temperature": 0, "num_predict": 1}
         }).encode("utf-8")
-        req = urllib.request.Request(f"{host}/api/generate", data=payload,
-                                     headers={"Content-Type":"application/json"})
-        urllib.request.urlopen(req, timeout=15).read()
+        _ollama_post(f"{host}/api/chat", payload, 15)
         print(f"[warm] model loaded: {model}")
     except Exception as e:
         print(f"[warm] skip ({e})")
 
+def _warm_ollama_async(keep_alive: str = "24h"):
+    # 起動/UI操作をブロックしないようバックグラウンドでロード
+    threading.Thread(target=_warm_ollama, args=(keep_alive,), daemon=True).start()
+
 # ---------- 速度対策 2: assessment.py 等を同一プロセス実行 ----------
+# コンパイル済みコードをキャッシュ（ファイルが変わったときだけ再コンパイル）
+_CODE_CACHE: dict[str, tuple[tuple[int, int], types.CodeType]] = {}
+
+def _compiled(script_path: Path) -> types.CodeType:
+    st = script_path.stat(); sig = (st.st_mtime_ns, st.st_size); key = str(script_path)
+    c = _CODE_CACHE.get(key)
+    if c and c[0] == sig: return c[1]
+    code = compile(script_path.read_bytes(), key, "exec")
+    _CODE_CACHE[key] = (sig, code)
+    return code
+
+# sys.stdin/sys.stdout はプロセス共通なので、スレッド実行では差し替え〜復元を同時に 1 本だけにする
+# （重なると他の実行のバッファを stdout に残したまま close してしまい、出力の欠けや ValueError になる）
+_INPROC_LOCK = threading.Lock()
+
 def _run_inproc(script_path: Path, stdin_text: str|None = None):
     t0 = time.time()
-    old_in, old_out = sys.stdin, sys.stdout
     buf_in  = io.StringIO(stdin_text or "")
-    buf_out = io.StringIO()
-    sys.stdin, sys.stdout = buf_in, buf_out
+    # 出力が小さいうちはメモリ上、64KB を超えたら一時ファイルへ逃がす（巨大な StringIO の再確保を避ける）
+    buf_out = tempfile.SpooledTemporaryFile(max_size=65536, mode="w+", encoding="utf-8", errors="replace")
     rc = 0
-    try:
-        runpy.run_path(str(script_path), run_name="__main__")
-    except SystemExit as e:
-        rc = int(getattr(e, "code", 0) or 0)
-    except Exception as e:
-        rc = 1
-        buf_out.write(f"\n[ERROR] {type(e).__name__}: {e}\n")
-    finally:
-        sys.stdin, sys.stdout = old_in, old_out
-    out = buf_out.getvalue()
+    with _INPROC_LOCK:
+        old_in, old_out = sys.stdin, sys.stdout
+        sys.stdin, sys.stdout = buf_in, buf_out
+        try:
+            exec(_compiled(script_path), {"__name__": "__main__", "__file__": str(script_path),
+                                          "__builtins__": builtins, "__package__": None, "__spec__": None})
+        except SystemExit as e:
+            rc = int(getattr(e, "code", 0) or 0)
+        except Exception as e:
+            rc = 1
+            buf_out.write(f"\n[ERROR] {type(e).__name__}: {e}\n")
+        finally:
+            sys.stdin, sys.stdout = old_in, old_out
+    buf_out.seek(0); out = buf_out.read(); buf_out.close()
     dt  = time.time() - t0
     print(f"[inproc] {script_path.name} done rc={rc} {dt:.2f}s, out={len(out)}B")
     return rc, out
 
+# ---------- 速度対策 3: 重いライブラリを読み込み済みの forkserver ワーカーで実行 ----------
+# 各ワーカーは使い回すので import は初回だけ。stdin/stdout の差し替えもプロセスごとに独立する
+WORKER_PRELOAD = ["json", "re", "urllib.request", "numpy", "pandas", "openpyxl", "requests"]
+_EXEC: ProcessPoolExecutor|None = None
+_EXEC_LOCK = threading.Lock()
+
+def _executor() -> ProcessPoolExecutor|None:
+    global _EXEC
+    with _EXEC_LOCK:
+        if _EXEC is None and "forkserver" in multiprocessing.get_all_start_methods():
+            try:
+                ctx = multiprocessing.get_context("forkserver")
+                ctx.set_forkserver_preload(WORKER_PRELOAD)  # import できないものは無視される
+                _EXEC = ProcessPoolExecutor(max_workers=4, mp_context=ctx)
+            except Exception as e:
+                print(f"[worker] forkserver unavailable ({e}); using threads")
+        return _EXEC
+
+def _preload_inproc() -> None:
+    # スレッド実行時はスクリプトがこのプロセスの sys.modules を共有するので、重いライブラリを先に読み込んでおく
+    for m in WORKER_PRELOAD:
+        try: __import__(m)
+        except Exception: pass
+
+# stdout/stderr は確認用に末尾だけ残す（本文は result に全量ある。/status で同じ本文を 2 回送らない）
+LOG_TAIL_CHARS = 16 * 1024
+
+def _tail(s: str) -> str:
+    return s if len(s) <= LOG_TAIL_CHARS else "…" + s[-LOG_TAIL_CHARS:]
+
+def _finish(name, rc, out, err=""):
+    out = out or ""
+    with LOCK:
+        TASKS[name].update({"running":False,"done":True,"rc":rc,
+                            "stdout":_tail(out),"stderr":_tail(err or ""), "result":out.strip()})
+        _bump(name)
+
+# forkserver が使えないときの実行スレッド。stdout の差し替えが 1 本ずつなので 1 スレッドで順に流す
+# （待ちはキューに残るので、着手前なら /cancel で取り消せる）
+_RUN_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nurse-run")
+_FUTURES: dict[str, Future] = {}
+
 def _spawn(name, script_filename, stdin_text=None):
     with LOCK:
         TASKS[name] = {"running": True, "done": False, "rc": None,
                        "result": "", "stdout": "", "stderr": "", "proc": "inproc"}
-    def run():
-        try:
-            rc, out = _run_inproc(APP_DIR / script_filename, stdin_text)
-            with LOCK:
-                TASKS[name].update({"running":False,"done":True,"rc":rc,
-                                    "stdout":out or "","stderr":"", "result":(out or "").strip()})
-        except Exception as e:
-            with LOCK:
-                TASKS[name].update({"running":False,"done":True,"rc":1,"stderr":str(e)})
-    threading.Thread(target=run, daemon=True).start()
+        _bump(name)
+    def done(fut):
+        with LOCK:
+            if _FUTURES.get(name) is not fut: return  # 中止済み、または新しい実行に置き換え済み
+            del _FUTURES[name]
+        if fut.cancelled(): return
+        try: rc, out = fut.result(); _finish(name, rc, out)
+        except Exception as e: _finish(name, 1, "", str(e))
+    fut = None; ex = _executor()
+    if ex is not None:
+        try: fut = ex.submit(_run_inproc, APP_DIR / script_filename, stdin_text)
+        except Exception as e: print(f"[worker] submit failed ({e}); using thread")
+    if fut is None: fut = _RUN_POOL.submit(_run_inproc, APP_DIR / script_filename, stdin_text)
+    with LOCK: _FUTURES[name] = fut
+    fut.add_done_callback(done)
 
 def _cancel(name):
+    if name not in TASKS: return  # 未知のキーで TASKS を増やさない
     with LOCK:
+        fut = _FUTURES.pop(name, None)
         TASKS.setdefault(name,{}).update({"running":False,"done":False,"rc":None})
+        _bump(name)
+    if fut is not None: fut.cancel()  # 未着手なら取り消し。実行中でも結果は捨てる
+
+SAVE_TARGETS = {
+    "assessment": (ASSESS_FINAL_TXT, ASSESS_RESULT_TXT),
+    "diagnosis":  (DIAG_FINAL_TXT,   DIAG_RESULT_TXT),
+    "record":     (RECORD_FINAL_TXT, RECORD_RESULT_TXT),
+    "careplan":   (PLAN_FINAL_TXT,   PLAN_RESULT_TXT),
+}
+
+def _atomic_replace(dst: Path, fill):
+    # 一時ファイルに書いてから os.replace（途中で落ちても壊れたファイルを残さない）
+    tmp = dst.with_name(dst.name + ".tmp")
+    try:
+        fill(tmp); os.replace(tmp, dst)
+    finally:
+        if tmp.exists(): tmp.unlink()
 
 def _save_text(kind: str, text: str):
-    mapping = {
-        "assessment": (ASSESS_FINAL_TXT, ASSESS_RESULT_TXT),
-        "diagnosis":  (DIAG_FINAL_TXT,   DIAG_RESULT_TXT),
-        "record":     (RECORD_FINAL_TXT, RECORD_RESULT_TXT),
-        "careplan":   (PLAN_FINAL_TXT,   PLAN_RESULT_TXT),
-    }
-    pair = mapping.get(kind)
+    pair = SAVE_TARGETS.get(kind)
     if not pair: return False, "unsupported kind"
-    fn_final, fn_result = pair
+    fn_final, fn_result = Path(pair[0]), Path(pair[1])
     try:
-        Path(fn_final).write_text(text or "", encoding="utf-8", errors="ignore")
-        Path(fn_result).write_text(text or "", encoding="utf-8", errors="ignore")
+        data = (text or "").encode("utf-8", "ignore")  # エンコードは 1 回だけ
+        _atomic_replace(fn_final, lambda t: t.write_bytes(data))
+        # result はハードリンクにしない（各スクリプトが result をその場で上書きすると final まで変わるため）
+        _atomic_replace(fn_result, lambda t: shutil.copyfile(fn_final, t))
         return True, "ok"
     except Exception as e:
         return False, str(e)
 
+_JSON_DEC = json.JSONDecoder()
+
 def _extract_json_block(s: str):
-    m = re.search(r"\{.*\}", s, re.S)
-    if not m: return None
-    try: return json.loads(m.group(0))
-    except Exception: return None
+    # 最初の '{' から 1 つ目の完結した JSON オブジェクトだけを読む（貪欲な正規表現のバックトラックを避ける）
+    i = s.find("{")
+    for _ in range(8):
+        if i < 0: return None
+        try:
+            obj, _end = _JSON_DEC.raw_decode(s, i)
+            if isinstance(obj, dict): return obj
+        except ValueError:
+            pass
+        i = s.find("{", i + 1)
+    return None
+
+# /ai/map_so の結果キャッシュ（同じ本文の再送でモデルを呼ばない）。患者情報を含むのでメモリ上のみに置く
+MAP_SO_CACHE_MAX = 512
+_MAP_SO_CACHE: "OrderedDict[str, dict]" = OrderedDict()
+_MAP_SO_LOCK = threading.Lock()
+_MAP_SO_INFLIGHT: dict[str, tuple[threading.Event, list]] = {}  # 同じ本文の同時要求は 1 回の呼び出しにまとめる
+# 割付 1 回の合計締切（秒）。stream の timeout は 1 回の読み取りにしか効かないので行ごとに確かめる
+MAP_SO_TIMEOUT_SEC = 40.0
+# 同一本文の後続要求が先行要求を待つ上限: 先行要求の最悪所要時間（接続 + 締切 + 締切直前に始まった読み取り 1 回）
+MAP_SO_WAIT_SEC = OLLAMA_CONNECT_TIMEOUT + 2 * MAP_SO_TIMEOUT_SEC + 1.0
+
+# 指示文は固定の system メッセージとして毎回同じ内容で送る（Ollama が先頭の KV キャッシュを使い回せる）
+MAP_SO_SYSTEM = """以下の看護記録テキストを S（主観）と O（客観）のテンプレに割り付けてください。
+出力は**厳密なJSON**のみ。キーは以下に限定。
+S側: shuso, keika, bui, seishitsu, inyo, zuikan, life, back, think, etc
+O側: name, T, HR, RR, SpO2, SBP, DBP, NRS, awareness, resp, circ, excrete, lab, risk, active, high, weight, etc
+値は文字列。無ければ空文字。日本語のままで。"""
+
+def _map_so_key(text: str) -> str:
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()  # 空白の揺れは同一視
 
 def _ai_map_so(text: str):
+    key = _map_so_key(text)
+    with _MAP_SO_LOCK:
+        hit = _MAP_SO_CACHE.get(key)
+        if hit is not None:
+            _MAP_SO_CACHE.move_to_end(key); return hit
+        fl = _MAP_SO_INFLIGHT.get(key); leader = fl is None
+        if leader: fl = _MAP_SO_INFLIGHT[key] = (threading.Event(), [None])
+    evt, box = fl
+    if not leader:
+        # 先行する同一要求の結果を待って共有する
+        evt.wait(MAP_SO_WAIT_SEC)
+        return box[0] or {"S":{}, "O":{}}
+    mapped = None
     try:
-        import json as _json, urllib.request
+        mapped = _ai_map_so_uncached(text)
+    finally:
+        with _MAP_SO_LOCK:
+            if mapped is not None:  # 失敗はキャッシュしない
+                _MAP_SO_CACHE[key] = mapped
+                while len(_MAP_SO_CACHE) > MAP_SO_CACHE_MAX: _MAP_SO_CACHE.popitem(last=False)
+            _MAP_SO_INFLIGHT.pop(key, None)
+        box[0] = mapped; evt.set()
+    return mapped or {"S":{}, "O":{}}
+
+# /ai/map_so_batch: 複数の本文を 1 回の HTTP 要求で受け、1 件ずつ並列に割り付ける
+# （件ごとにキャッシュ/同時要求のまとめが効く。並列数は ollama serve の OLLAMA_NUM_PARALLEL に合わせる）
+MAP_SO_BATCH_MAX = 32
+_MAP_SO_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="nurse-map-so")
+
+def _ai_map_so_batch(texts: list[str]) -> list[dict]:
+    texts = [str(t or "").strip() for t in texts[:MAP_SO_BATCH_MAX]]
+    return list(_MAP_SO_POOL.map(lambda t: _ai_map_so(t) if t else {"S":{}, "O":{}}, texts))
+
+# Ollama 停止中に各要求が 40 秒ずつ詰まらないよう、連続失敗したら一定時間は呼ばずに即返す
+MAP_SO_CB_FAILS = 3
+# 生成長の上限: 割付結果は本文の抜き出しなので本文の長さに比例させる（JSON が閉じないまま延々と生成し続けないように）
+MAP_SO_PREDICT_BASE, MAP_SO_PREDICT_MAX = 256, 4096
+MAP_SO_CB_OPEN_SEC = 30.0
+_MAP_SO_CB = {"fails": 0, "open_until": 0.0}
+_MAP_SO_CB_LOCK = threading.Lock()  # 要求スレッドと _MAP_SO_POOL から同時に読み書きされる
+
+def _ai_map_so_uncached(text: str):
+    with _MAP_SO_CB_LOCK:
+        if time.time() < _MAP_SO_CB["open_until"]: return None
+    try:
+        import json as _json
         host  = os.environ.get("OLLAMA_HOST","http://127.0.0.1:11434").rstrip("/")
         model = os.environ.get("AI_MODEL","qwen2.5:7b-instruct")
-        prompt = f"""
-以下の看護記録テキストを S（主観）と O（客観）のテンプレに割り付けてください。
-出力は**厳密なJSON**のみ。キーは以下に限定。
-S側: shuso, keika, bui, seishitsu, inyo, zuikan, life, back, think, etc
-O側: name, T, HR, RR, SpO2, SBP, DBP, NRS, awareness, resp, circ, excrete, lab, risk, active, high, weight, etc
-値は文字列。無ければ空文字。日本語のままで。
-テキスト:
-{text}
-"""
         payload = _json.dumps({
-            "model": model, "prompt": prompt,
-            "stream": False, "keep_alive": "24h",
-            "options": {"temperature": 0}
+            "model": model,
+            "messages": [{"role": "system", "content": MAP_SO_SYSTEM}, {"role": "user", "content": "テキスト:\n" + text}],
+            "stream": True, "keep_alive": "24h",
+            "options": {"temperature": 0, "num_predict": min(MAP_SO_PREDICT_MAX, MAP_SO_PREDICT_BASE + 2 * len(text))}
         }).encode("utf-8")
-        req = urllib.request.Request(f"{host}/api/generate", data=payload,
-                                     headers={"Content-Type":"application/json"})
-        with urllib.request.urlopen(req, timeout=40) as r:
-            js = _json.loads(r.read().decode("utf-8","ignore"))
-        raw = js.get("response","").strip()
-        data = _extract_json_block(raw)
-        if not data: return {"S":{}, "O":{}}
+        # 逐次受信し、最初の '{' から始まる JSON が閉じた時点で打ち切る（残りの説明文などの生成を待たない）
+        buf: list[str] = []; data = None
+        deadline = time.monotonic() + MAP_SO_TIMEOUT_SEC
+        stream = _ollama_stream(f"{host}/api/chat", payload, MAP_SO_TIMEOUT_SEC)
+        try:
+            for chunk in stream:
+                piece = (chunk.get("message") or {}).get("content") or ""
+                buf.append(piece)
+                if "}" in piece:
+                    raw = "".join(buf); i = raw.find("{")
+                    try: obj = _JSON_DEC.raw_decode(raw, i)[0] if i >= 0 else None
+                    except ValueError: obj = None
+                    if isinstance(obj, dict): data = obj; break
+                if time.monotonic() >= deadline: raise TimeoutError("map_so deadline")
+        finally:
+            stream.close()  # 打ち切り・締切超過でも接続を閉じて Ollama 側の生成を止める
+        with _MAP_SO_CB_LOCK: _MAP_SO_CB["fails"] = 0
+        if data is None: data = _extract_json_block("".join(buf).strip())
+        if not data: return None
         return {"S": data.get("S") or data.get("s") or {},
                 "O": data.get("O") or data.get("o") or {}}
     except Exception:
-        return {"S":{}, "O":{}}
+        with _MAP_SO_CB_LOCK:
+            _MAP_SO_CB["fails"] += 1
+            if _MAP_SO_CB["fails"] >= MAP_SO_CB_FAILS:
+                _MAP_SO_CB["open_until"] = time.time() + MAP_SO_CB_OPEN_SEC; _MAP_SO_CB["fails"] = 0
+        return None
 
 # ----------- 静的配信（/files/* と index / nurse_ui） -----------
+# files/ 直下の「名前 → 実体パス」索引。ディレクトリの mtime が変わったときだけ作り直す
+_FILES_INDEX: tuple[int|None, dict[str, Path]] = (None, {})
+
+def _files_index() -> dict[str, Path]:
+    global _FILES_INDEX
+    try: sig = os.stat(FILES_DIR).st_mtime_ns
+    except OSError: return {}
+    if _FILES_INDEX[0] == sig: return _FILES_INDEX[1]
+    idx: dict[str, Path] = {}; root = str(FILES_DIR)
+    with os.scandir(FILES_DIR) as it:
+        for e in it:
+            try:
+                if not e.is_file(): continue
+                rp = Path(e.path).resolve()
+                # シンボリックリンクで files/ の外を指すものは載せない（接頭辞比較ではなく commonpath で判定）
+                if os.path.commonpath([str(rp), root]) == root: idx[e.name] = rp
+            except (OSError, ValueError):
+                pass
+    _FILES_INDEX = (sig, idx)
+    return idx
+
 def _safe_join_files(subpath: str) -> Path|None:
-    # 先頭の /files/ をはずして正規化、ディレクトリトラバーサル対策
-    p = (FILES_DIR / Path(subpath).name) if "/" not in subpath else (FILES_DIR / subpath.split("/")[-1])
-    try:
-        rp = p.resolve()
-        if str(rp).startswith(str(FILES_DIR)):
-            return rp if rp.exists() else None
-        return None
-    except Exception:
-        return None
+    # basename だけで索引を引く（ディレクトリトラバーサル不可、リクエストごとの resolve も不要）
+    return _files_index().get(subpath.rsplit("/", 1)[-1])
 
 def _mime_guess(fn: str) -> str:
     m, _ = mimetypes.guess_type(fn)
@@ -172,88 +427,213 @@ def _mime_guess(fn: str) -> str:
     if fn.endswith(".json"):return "application/json; charset=utf-8"
     return "application/octet-stream"
 
+# 静的アセットのメモリキャッシュ（mtime/サイズが変わったときだけ読み直す）
+# HTML などテキストは gzip 版も 1 回だけ作っておく（xlsx は既に圧縮済みなので対象外）
+_STATIC_CACHE: dict[str, tuple[tuple[int, int], bytes, str, bytes|None]] = {}
+
+def _get_static(path: Path, compress: bool = False) -> tuple[bytes, str, bytes|None]:
+    st = path.stat(); sig = (st.st_mtime_ns, st.st_size)
+    c = _STATIC_CACHE.get(str(path))
+    if c and c[0] == sig: return c[1], c[2], c[3]
+    b = path.read_bytes(); etag = '"' + hashlib.sha1(b).hexdigest() + '"'
+    gz = gzip.compress(b, 6) if compress else None
+    _STATIC_CACHE[str(path)] = (sig, b, etag, gz)
+    return b, etag, gz
+
+def _file_etag(st: os.stat_result) -> str:
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
 class Handler(BaseHTTPRequestHandler):
-    def _send(self, data: bytes, ctype="application/octet-stream", code=200):
+    # HTTP/1.1 + keep-alive: UI のポーリングが毎回 TCP 接続し直さない（全応答に Content-Length を付ける前提）
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, data: bytes, ctype="application/octet-stream", code=200, headers: dict|None = None):
         self.send_response(code)
         self.send_header("Content-Type", ctype)
         self.send_header("Content-Length", str(len(data)))
+        self.send_header("Connection", "keep-alive")
+        for k, v in (headers or {}).items(): self.send_header(k, v)
         self.end_headers()
-        self.wfile.write(data)
+        if data: self.wfile.write(data)
 
-    def _send_json(self, obj, code=200): self._send(json.dumps(obj, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8", code)
+    def _send_static(self, path: Path, ctype: str, compress: bool = False, headers: dict|None = None):
+        # ETag が一致すれば 304（本文なし）で返す。gzip 可ならキャッシュ済みの圧縮版を返す
+        data, etag, gz = _get_static(path, compress)
+        h = {"ETag": etag, **(headers or {})}
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(b"", ctype, 304, h)
+        if gz is not None and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            return self._send(gz, ctype, 200, {**h, "Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+        return self._send(data, ctype, 200, {**h, "Vary": "Accept-Encoding"} if gz is not None else h)
 
-    def do_GET(self):
-        p = urlparse(self.path).path
-        if p in ("/","/index.html"):
-            return self._send(Path("index.html").read_bytes(), "text/html; charset=utf-8")
-        if p in ("/nurse_ui.html","/app"):
-            return self._send(Path("nurse_ui.html").read_bytes(), "text/html; charset=utf-8")
-        if p == "/ai/health":
-            return self._send_json({"ok": True, "message": "alive"})
-        if p == "/nanda.xlsx":
-            q = Path(NANDA_XLSX)
-            if not q.exists(): return self._send_json({"ok":False,"error":"nanda_db.xlsx not found"},404)
-            return self._send(q.read_bytes(), "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-
-        if p.startswith("/files/"):
-            sub = p.replace("/files/","",1)
-            q = _safe_join_files(sub)
-            if not q: return self._send_json({"ok":False,"error":"not found"},404)
-            return self._send(q.read_bytes(), _mime_guess(q.name))
-
-        if p.startswith("/status/"):
-            key = p.split("/")[-1]
-            st = TASKS.get(key, {"running": False, "done": False})
-            return self._send_json(st)
-
-        return self._send_json({"ok":False,"error":"not found"},404)
+    def _send_file(self, path: Path, ctype: str):
+        # ファイル全体を bytes に読まず、sendfile(2)（不可なら 64KB 単位のコピー）で直接ソケットへ流す
+        with path.open("rb") as f:
+            st = os.fstat(f.fileno()); size = st.st_size; etag = _file_etag(st)
+            if self.headers.get("If-None-Match") == etag:
+                return self._send(b"", ctype, 304, {"ETag": etag})
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(size))
+            self.send_header("Connection", "keep-alive")
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.connection.sendfile(f, 0, size)
 
-    def do_POST(self):
-        p = urlparse(self.path).path
-        ln = int(self.headers.get("Content-Length") or 0)
-        body = self.rfile.read(ln).decode("utf-8") if ln>0 else ""
-        try: js = json.loads(body) if body else {}
-        except Exception: js = {}
+    def _send_json(self, obj, code=200): self._send(_json_dumps(obj), "application/json; charset=utf-8", code)
+
+    def _send_prebuilt(self, buf: bytes, code=200): self._send(buf, "application/json; charset=utf-8", code)
+
+    # ---------- GET ----------
+    def _get_index(self, u):
+        return self._send_static(Path("index.html"), "text/html; charset=utf-8", compress=True)
+
+    def _get_ui(self, u):
+        return self._send_static(Path("nurse_ui.html"), "text/html; charset=utf-8", compress=True)
+
+    def _get_health(self, u):
+        return self._send_json({"ok": True, "message": "alive"})
+
+    def _get_nanda(self, u):
+        # 本体はメモリにキャッシュ（更新時刻が変わったときだけ読み直す）。xlsx は zip なので gzip はかけない。
+        # DB の差し替えがすぐ反映されるよう、ブラウザには毎回 ETag で再検証させる（変わっていなければ 304）
+        q = Path(NANDA_XLSX)
+        try: st = q.stat()
+        except OSError: return self._send_json({"ok":False,"error":"nanda_db.xlsx not found"},404)
+        return self._send_static(q, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                 headers={"Cache-Control": "no-cache", "Last-Modified": formatdate(st.st_mtime, usegmt=True)})
 
-        if p.startswith("/save/"):
-            ok, msg = _save_text(p.split("/")[-1], js.get("text",""))
-            return self._send_json({"ok":ok,"message":msg}, 200 if ok else 500)
+    def _get_file(self, u, sub):
+        q = _safe_join_files(sub)
+        if not q: return self._send_prebuilt(_NOT_FOUND_JSON, 404)
+        return self._send_file(q, _mime_guess(q.name))
 
-        if p == "/run/assessment":
+    def _get_status(self, u, key):
+        q = parse_qs(u.query)
+        # ?wait=1&since=<seq>: 状態が変わるまで（最大 STATUS_WAIT_SEC 秒）待ってから返す
+        if q.get("wait", ["0"])[0] == "1":
+            try: since = int(q.get("since", ["-1"])[0])
+            except ValueError: since = -1
+            with COND:
+                COND.wait_for(lambda: TASKS.get(key, {}).get("seq", 0) > since, timeout=STATUS_WAIT_SEC)
+        # 読み取りはロック不要（組ごと差し替えるので dict.get 1 回で整合した値が取れる）
+        # 前回から変わっていなければ 304（本文なし）。no-cache でブラウザには毎回再検証させる
+        buf, gz, etag = _STATUS_BYTES.get(key, _STATUS_IDLE)
+        h = {"ETag": etag, "Cache-Control": "no-cache"}
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(b"", "application/json; charset=utf-8", 304, h)
+        if gz is not None and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            return self._send(gz, "application/json; charset=utf-8", 200, {**h, "Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+        return self._send(buf, "application/json; charset=utf-8", 200, h)
+
+    def _get_status_all(self, u):
+        # 4 種の状態を 1 往復で返す。各状態の JSON は作り置きの bytes をつなぐだけ（再エンコードしない）
+        q = parse_qs(u.query)
+        if q.get("wait", ["0"])[0] == "1":
+            try: since = int(q.get("since", ["-1"])[0])
+            except ValueError: since = -1
+            with COND:
+                COND.wait_for(lambda: any(TASKS.get(k, {}).get("seq", 0) > since for k in STATUS_KEYS), timeout=STATUS_WAIT_SEC)
+        # 世代番号は全タスク共通で単調増加なので、読み出し前の _SEQ で全体の版を表せる（途中で進んでも次回 200 になるだけ）
+        etag = f'"{_BOOT_ID}-all-{_SEQ}"'
+        snaps = [_STATUS_BYTES.get(k, _STATUS_IDLE) for k in STATUS_KEYS]
+        h = {"ETag": etag, "Cache-Control": "no-cache"}
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(b"", "application/json; charset=utf-8", 304, h)
+        buf = b"{" + b",".join(b'"%s":%s' % (k.encode(), b) for k, (b, _g, _e) in zip(STATUS_KEYS, snaps)) + b"}"
+        if len(buf) >= GZIP_MIN_BYTES and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            return self._send(gzip.compress(buf, 1), "application/json; charset=utf-8", 200, {**h, "Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+        return self._send(buf, "application/json; charset=utf-8", 200, h)
+
+    # ---------- POST ----------
+    def _post_run(self, js, name):
+        if name == "assessment":
             S = js.get("S",""); O = js.get("O","")
-            payload = f"{S}\n<<<SEP>>>\n{O}"
-            _spawn("assessment", "assessment.py", stdin_text=payload)
-            return self._send_json({"ok": True})
+            _spawn("assessment", "assessment.py", stdin_text=f"{S}\n<<<SEP>>>\n{O}")
+        else:
+            _spawn(name, f"{name}.py")
+        return self._send_prebuilt(_OK_JSON)
+
+    def _post_review(self, js):
+        text = (js.get("text") or "").strip()
+        return self._send_json({"ok": True, "review": text})
+
+    def _post_warmup(self, js):
+        _warm_ollama_async(str(js.get("keep_alive") or "30m"))
+        return self._send_prebuilt(_OK_JSON)
+
+    def _post_map_so(self, js):
+        t = (js.get("text") or "").strip()
+        mapped = _ai_map_so(t) if t else {"S":{}, "O":{}}
+        return self._send_json({"ok": True, "mapped": mapped})
 
-        if p == "/run/diagnosis":
-            _spawn("diagnosis", "diagnosis.py");  return self._send_json({"ok": True})
-        if p == "/run/record":
-            _spawn("record", "record.py");        return self._send_json({"ok": True})
-        if p == "/run/careplan":
-            _spawn("careplan", "careplan.py");    return self._send_json({"ok": True})
+    def _post_map_so_batch(self, js):
+        texts = js.get("texts")
+        if not isinstance(texts, list): return self._send_json({"ok":False,"error":"texts must be a list"},400)
+        if len(texts) > MAP_SO_BATCH_MAX: return self._send_json({"ok":False,"error":f"too many texts (max {MAP_SO_BATCH_MAX})"},400)
+        return self._send_json({"ok": True, "mapped": _ai_map_so_batch(texts)})
 
-        if p.startswith("/cancel/"):
-            _cancel(p.split("/")[-1]); return self._send_json({"ok": True})
+    def _post_save(self, js, kind):
+        ok, msg = _save_text(kind, js.get("text",""))
+        return self._send_json({"ok":ok,"message":msg}, 200 if ok else 500)
 
-        if p in ("/review/assessment","/review/record","/review/careplan"):
-            text = (js.get("text") or "").strip()
-            return self._send_json({"ok": True, "review": text})
+    def _post_cancel(self, js, name):
+        _cancel(name); return self._send_prebuilt(_OK_JSON)
 
-        if p == "/ai/map_so":
-            t = (js.get("text") or "").strip()
-            mapped = _ai_map_so(t) if t else {"S":{}, "O":{}}
-            return self._send_json({"ok": True, "mapped": mapped})
+    # 完全一致は dict 1 回の参照で振り分け、可変部分を持つものだけ接頭辞で振り分ける
+    GET_ROUTES = {"/": _get_index, "/index.html": _get_index, "/nurse_ui.html": _get_ui, "/app": _get_ui,
+                  "/ai/health": _get_health, "/nanda.xlsx": _get_nanda, "/status_all": _get_status_all}
+    GET_PREFIXES = (("/status/", _get_status), ("/files/", _get_file))
+    POST_ROUTES = {"/run/assessment": functools.partial(_post_run, name="assessment"),
+                   "/run/diagnosis":  functools.partial(_post_run, name="diagnosis"),
+                   "/run/record":     functools.partial(_post_run, name="record"),
+                   "/run/careplan":   functools.partial(_post_run, name="careplan"),
+                   "/review/assessment": _post_review, "/review/record": _post_review, "/review/careplan": _post_review,
+                   "/ai/warmup": _post_warmup, "/ai/map_so": _post_map_so,
+                   "/ai/map_so_batch": _post_map_so_batch}
+    POST_PREFIXES = (("/save/", _post_save), ("/cancel/", _post_cancel))
+    POST_NO_BODY = {_post_cancel, POST_ROUTES["/run/diagnosis"], POST_ROUTES["/run/record"], POST_ROUTES["/run/careplan"]}
 
-        return self._send_json({"ok":False,"error":"not found"},404)
+    def do_GET(self):
+        u = urlparse(self.path); p = u.path
+        h = self.GET_ROUTES.get(p)
+        if h: return h(self, u)
+        for pre, h in self.GET_PREFIXES:
+            if p.startswith(pre): return h(self, u, p[len(pre):])
+        return self._send_prebuilt(_NOT_FOUND_JSON, 404)
+
+    def do_POST(self):
+        # 先に振り分け先を決め、本文を使わない要求では JSON を解析しない（keep-alive のため本文は必ず読み切る）
+        p = urlparse(self.path).path
+        h = self.POST_ROUTES.get(p); args = ()
+        if h is None:
+            for pre, ph in self.POST_PREFIXES:
+                if p.startswith(pre): h, args = ph, (p[len(pre):],); break
+        ln = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(ln) if ln>0 else b""
+        if h is None: return self._send_prebuilt(_NOT_FOUND_JSON, 404)
+        js = {}
+        if body and h not in self.POST_NO_BODY:
+            try: js = _json_loads(body)
+            except Exception: js = {}
+        return h(self, js, *args)
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--host", default="127.0.0.1")
     ap.add_argument("--port", type=int, default=int(os.environ.get("NURSE_PORT","8787")))
     args = ap.parse_args()
-    _warm_ollama()
-    httpd = HTTPServer((args.host, args.port), Handler)
+    # 接続ごとにスレッドで処理し、/status ポーリングと /files 配信が直列に待たない
+    httpd = ThreadingHTTPServer((args.host, args.port), Handler); httpd.daemon_threads = True
     print(f"Serving on http://{args.host}:{args.port}")
+    _warm_ollama_async()
+    if _executor() is None:
+        threading.Thread(target=_preload_inproc, daemon=True).start()
+    for fn in ("index.html", "nurse_ui.html"):  # 初回アクセス前に HTML と gzip 版をキャッシュしておく
+        try: _get_static(Path(fn), compress=True)
+        except OSError: pass
+    try: _get_static(Path(NANDA_XLSX))
+    except OSError: pass
     httpd.serve_forever()
 
 if __name__ == "__main__":
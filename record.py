@@ -23,21 +23,29 @@ record.py — 高速・内容保持版（並列 + キャッシュ + 重要行ト
   RECORD_AI_BUDGET_SEC=25     -> AI合計時間の上限秒（0で無制限）
   RECORD_PER_CALL_TIMEOUT=20  -> 1回のAI問い合わせの最大秒（動的短縮あり）
   OLLAMA_NUM_PREDICT=700      -> 生成トークン上限（小さいほど速い）
+  OLLAMA_KEEP_ALIVE=10m       -> 呼び出し後もモデルを常駐させる時間（開始時にウォームアップも行う）
 
   # 追加（本版の高速オプション）:
   RECORD_AI_WORKERS=4         -> AI並列呼び出し数（ローカルGPU/CPUに合わせて）
   RECORD_TRIM_CHARS=1400      -> AIに渡す本文の最大文字数（重要行を優先採用）
-  RECORD_AI_CACHE=record_ai_cache.json  -> 応答キャッシュの保存先
+  RECORD_AI_CACHE=record_ai_cache.sqlite3  -> 応答キャッシュの保存先（SQLite。旧 record_ai_cache.json は初回に取り込む）
 """
 
 from __future__ import annotations
-import os, re, time, json, unicodedata
+import os, re, sys, time, json, unicodedata, functools, threading, sqlite3
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 import hashlib
 
+# orjson（任意）: ストリーム応答の各行や旧キャッシュ JSON を bytes のまま速く読む
+try:
+    import orjson as _orjson
+    def _json_loads(b): return _orjson.loads(b)
+except Exception:
+    def _json_loads(b): return json.loads(b)
+
 # ====== 入出力 ======
 ASSESS1 = "assessment_final.txt"
 ASSESS2 = "assessment_result.txt"
@@ -76,74 +84,130 @@ NUM_PREDICT     = _env_int("OLLAMA_NUM_PREDICT",       700,  1200)
 # 新規の高速系
 AI_WORKERS      = _env_int("RECORD_AI_WORKERS",          4,     3)   # 並列数
 TRIM_CHARS      = _env_int("RECORD_TRIM_CHARS",       1400,  1600)   # トリム上限
-AI_CACHE_PATH   = _env_str("RECORD_AI_CACHE", "record_ai_cache.json", "record_ai_cache.json")
+AI_CACHE_PATH   = _env_str("RECORD_AI_CACHE", "record_ai_cache.sqlite3", "record_ai_cache.sqlite3")
+AI_CACHE_LEGACY_JSON = "record_ai_cache.json"  # 旧形式（全件 JSON）。DB を新規作成したときに 1 回だけ取り込む
 
 # ====== Ollama ======
 OLLAMA_BASE   = os.getenv("OLLAMA_BASE",  "http://127.0.0.1:11434").rstrip("/")
 OLLAMA_MODEL  = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct")
 CONNECT_TO    = 5.0  # 接続開始のタイムアウト（秒）
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "10m")  # 呼び出しごとにモデルの常駐時間を延長
+
+@functools.lru_cache(maxsize=1)
+def _session():
+    """Ollama への接続を並列スレッド間で使い回すセッション（初回だけ作る）"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    s = requests.Session()
+    s.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=max(8, AI_WORKERS * 2), max_retries=0))
+    return s
 
 def _ollama_ok() -> bool:
     if DISABLE_AI:
         return False
     try:
-        import requests
-        r = requests.get(OLLAMA_BASE + "/api/tags", timeout=CONNECT_TO)
+        r = _session().get(OLLAMA_BASE + "/api/tags", timeout=CONNECT_TO)
         return r.status_code == 200
     except Exception:
         return False
 
-def _ollama_chat(system: str, user: str, timeout: float) -> str:
+def _ollama_warm():
+    """並列呼び出しの前にモデルをロードしておく（初回ロード待ちで各呼び出しの時間枠を食わないように）。失敗は無視"""
+    try:
+        _session().post(OLLAMA_BASE + "/api/chat", json={
+            "model": OLLAMA_MODEL,  # system 部分の KV キャッシュも作っておく
+            "messages": [{"role":"system","content":AI_REC_SYS},{"role":"user","content":"ok"}],
+            "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE,
+            "options": {"temperature": 0.2, "num_predict": 1},
+        }, timeout=(CONNECT_TO, PER_CALL_TO_DEF))
+    except Exception:
+        pass
+
+# 記録は「前半／後半」の段落文なので、段落が 2 つ閉じたら残りの生成は待たずに打ち切る
+STREAM_MAX_PARAS = 2
+
+def _ollama_stream(url: str, payload: dict, field, deadline: float) -> Tuple[str, bool]:
+    """stream=True で受け取り、段落が STREAM_MAX_PARAS 個そろった時点で接続を閉じる（Ollama 側の生成も止まる）。
+    stream では timeout が 1 回の読み込みにしか効かないので、deadline（time.monotonic）を行ごとに確かめ、過ぎたら TimeoutError。
+    戻り値は (本文, キャッシュしてよいか)。段落数での打ち切りは想定どおりの出力なので True、num_predict 切れは False"""
+    buf = []
+    left = deadline - time.monotonic()
+    if left <= 0: raise TimeoutError("ollama deadline")
+    with _session().post(url, json=payload, stream=True, timeout=(min(CONNECT_TO, left), left)) as r:
+        if r.status_code == 404:
+            raise FileNotFoundError("api404")
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line: continue
+            obj = _json_loads(line)
+            piece = field(obj) or ""
+            buf.append(piece)
+            if "\n" in piece:  # 空行はトークンをまたいで来ることがあるので改行のたびに数える
+                text = "".join(buf)
+                if text.count("。\n\n") >= STREAM_MAX_PARAS:
+                    cut = 0
+                    for _ in range(STREAM_MAX_PARAS): cut = text.index("。\n\n", cut) + 1
+                    return text[:cut].strip(), True
+            if obj.get("done"):
+                return "".join(buf).strip(), obj.get("done_reason") != "length"
+            if time.monotonic() >= deadline: raise TimeoutError("ollama deadline")
+    return "".join(buf).strip(), False  # done を受け取る前に切れた
+
+def _ollama_chat(system: str, user: str, timeout: float) -> Tuple[str, bool]:
     """
     まず /api/chat、失敗時は /api/generate にフォールバック。
+    timeout は両方を合わせた合計秒（フォールバック側は残り時間だけ使う）。戻り値は (本文, キャッシュしてよいか)
     """
-    import requests
+    deadline = time.monotonic() + timeout
     # /api/chat
     try:
-        r = requests.post(
+        return _ollama_stream(
             OLLAMA_BASE + "/api/chat",
-            json={
+            {
                 "model": OLLAMA_MODEL,
-                "stream": False,
+                "stream": True, "keep_alive": OLLAMA_KEEP_ALIVE,
                 "options": {"temperature": 0.2, "num_predict": NUM_PREDICT},
                 "messages": [{"role":"system","content":system},{"role":"user","content":user}]
             },
-            timeout=timeout
+            lambda o: (o.get("message") or {}).get("content"), deadline
         )
-        if r.status_code == 404:
-            raise FileNotFoundError("apichat404")
-        r.raise_for_status()
-        return ((r.json().get("message") or {}).get("content") or "").strip()
+    except TimeoutError:
+        raise
     except Exception:
         # /api/generate
         prompt = f"### System\n{system}\n\n### User\n{user}\n"
-        r = requests.post(
+        return _ollama_stream(
             OLLAMA_BASE + "/api/generate",
-            json={
+            {
                 "model": OLLAMA_MODEL,
                 "prompt": prompt,
-                "stream": False,
+                "stream": True, "keep_alive": OLLAMA_KEEP_ALIVE,
                 "options": {"temperature": 0.2, "num_predict": NUM_PREDICT},
             },
-            timeout=timeout
+            lambda o: o.get("response"), deadline
         )
-        r.raise_for_status()
-        return (r.json().get("response") or "").strip()
 
 # ====== ユーティリティ ======
+@functools.lru_cache(maxsize=4096)
 def nfkc(s: str) -> str:
+    # 診断名・因子の語は何度も同じ文字列で来るので結果を覚えておく
     return unicodedata.normalize("NFKC", s or "")
 
 def read_text(p: str) -> str:
-    path = Path(p)
-    return path.read_text(encoding="utf-8", errors="ignore") if path.exists() else ""
+    # バイトで読んで 1 回だけデコード（exists() の stat とテキストモードの層を省く）。改行は従来どおり \n にそろえる
+    try: s = Path(p).read_bytes().decode("utf-8", "ignore")
+    except OSError: return ""
+    return s.replace("\r\n", "\n").replace("\r", "\n") if "\r" in s else s
 
 def save_text(p: str, s: str):
     Path(p).write_text((s or "").rstrip() + "\n", encoding="utf-8")
 
+_RE_SPACES  = re.compile(r"[ \t\u3000]+")
+_RE_BLANKS  = re.compile(r"\n{3,}")
+
 def clean(s: str) -> str:
-    s = re.sub(r"[ \t\u3000]+", " ", s)
-    s = re.sub(r"\n{3,}", "\n\n", s)
+    s = _RE_SPACES.sub(" ", s)
+    s = _RE_BLANKS.sub("\n\n", s)
     return s.strip()
 
 def uniq_keep(xs: List[str]) -> List[str]:
@@ -156,20 +220,30 @@ def uniq_keep(xs: List[str]) -> List[str]:
 
 # ====== アセスメント解析 ======
 _NUM = r"(\d+(?:\.\d+)?)"
-def fnum(pat: str, text: str) -> Optional[float]:
-    m = re.search(pat, text, flags=re.IGNORECASE)
+def fnum(pat: "re.Pattern[str]", text: str) -> Optional[float]:
+    m = pat.search(text)
     return float(m.group(1)) if m else None
 
+# バイタル抽出用（読み込み時に 1 回だけコンパイル）
+_RE_T    = re.compile(r"(?:体温|t)\s*[:=]?\s*"+_NUM, re.I)
+_RE_HR   = re.compile(r"(?:hr|心拍|脈拍)\s*[:=]?\s*"+_NUM, re.I)
+_RE_RR   = re.compile(r"(?:rr|呼吸数)\s*[:=]?\s*"+_NUM, re.I)
+_RE_SPO2 = re.compile(r"(?:spo2|ｓｐｏ２|サチュ)\s*[:=]?\s*"+_NUM, re.I)
+_RE_BP   = re.compile(r"\b(\d{2,3})\s*/\s*(\d{2,3})\b", re.I)
+_RE_SBP  = re.compile(r"(?:sbp|収縮期|上の血圧)\s*[:=]?\s*"+_NUM, re.I)
+_RE_DBP  = re.compile(r"(?:dbp|拡張期|下の血圧)\s*[:=]?\s*"+_NUM, re.I)
+_RE_NRS  = re.compile(r"(?:nrs|疼痛(?:スケール)?)\D{0,6}"+_NUM, re.I)
+
 def parse_vitals(text: str) -> Dict[str, Optional[float]]:
-    T    = fnum(r"(?:体温|t)\s*[:=]?\s*"+_NUM, text)
-    HR   = fnum(r"(?:hr|心拍|脈拍)\s*[:=]?\s*"+_NUM, text)
-    RR   = fnum(r"(?:rr|呼吸数)\s*[:=]?\s*"+_NUM, text)
-    SpO2 = fnum(r"(?:spo2|ｓｐｏ２|サチュ)\s*[:=]?\s*"+_NUM, text)
-    bp   = re.search(r"\b(\d{2,3})\s*/\s*(\d{2,3})\b", text, re.IGNORECASE)
-    SBP  = float(bp.group(1)) if bp else fnum(r"(?:sbp|収縮期|上の血圧)\s*[:=]?\s*"+_NUM, text)
-    DBP  = float(bp.group(2)) if bp else fnum(r"(?:dbp|拡張期|下の血圧)\s*[:=]?\s*"+_NUM, text)
+    T    = fnum(_RE_T, text)
+    HR   = fnum(_RE_HR, text)
+    RR   = fnum(_RE_RR, text)
+    SpO2 = fnum(_RE_SPO2, text)
+    bp   = _RE_BP.search(text)
+    SBP  = float(bp.group(1)) if bp else fnum(_RE_SBP, text)
+    DBP  = float(bp.group(2)) if bp else fnum(_RE_DBP, text)
     MAP  = (SBP + 2*DBP)/3 if (SBP is not None and DBP is not None) else None
-    NRS  = fnum(r"(?:nrs|疼痛(?:スケール)?)\D{0,6}"+_NUM, text)
+    NRS  = fnum(_RE_NRS, text)
     return {"T":T,"HR":HR,"RR":RR,"SpO2":SpO2,"SBP":SBP,"DBP":DBP,"MAP":MAP,"NRS":NRS}
 
 SYM = {
@@ -180,14 +254,21 @@ SYM = {
     "嘔気嘔吐":["吐き気","嘔気","嘔吐","むかつき"],
     "排便":["便秘","下痢","軟便","水様便"],
 }
-def symptom_hits(text: str) -> List[str]:
+_SYM_WORDS = tuple((k, tuple([k]+vs)) for k,vs in SYM.items())
+
+@functools.lru_cache(maxsize=8)
+def _symptom_hits_cached(text: str) -> Tuple[str, ...]:
+    # 同じ全文/SO が診断ごとに何度も渡るので、NFKC 正規化と走査は本文ごとに 1 回だけ
     t = nfkc(text)
     hits=[]
-    for k,vs in SYM.items():
-        for w in [k]+vs:
+    for _k, words in _SYM_WORDS:
+        for w in words:
             if w in t:
                 hits.append(w); break
-    return uniq_keep(hits)
+    return tuple(uniq_keep(hits))
+
+def symptom_hits(text: str) -> List[str]:
+    return list(_symptom_hits_cached(text or ""))
 
 def abnormal_vitals(v: Dict[str, Optional[float]]) -> List[str]:
     o=[]
@@ -200,23 +281,32 @@ def abnormal_vitals(v: Dict[str, Optional[float]]) -> List[str]:
     if v.get("NRS") is not None and (v["NRS"]>=4): o.append(f"NRS{int(v['NRS'])}")
     return o
 
+_RE_DIGIT = re.compile(r"\d")
+_RE_VITAL = re.compile(r"(SpO2|RR|HR|NRS|BP|SBP|DBP|MAP|体温|呼吸数|脈拍)", re.I)
+
 def _score_line_importance(ln: str) -> int:
     """重要行スコアリング：数字/バイタル/症状/ゴードン/ヘンダーソンを優先"""
     s = nfkc(ln)
     score = 0
-    if re.search(r"\d", s): score += 2
-    if re.search(r"(SpO2|RR|HR|NRS|BP|SBP|DBP|MAP|体温|呼吸数|脈拍)", s, re.I): score += 3
+    if _RE_DIGIT.search(s): score += 2
+    if _RE_VITAL.search(s): score += 3
     if any(w in s for w in ("息苦","呼吸","痛","嘔","下痢","便秘","不安","ふらつ","転倒")): score += 2
     if "ゴードン" in s or "Gordon" in s: score += 2
     if "ヘンダーソン" in s or "Henderson" in s: score += 2
     if "背景" in s: score += 1
     return score
 
+_RE_BG_KEYS = re.compile(r"背景|既往|家族|生活|仕事|社会|経済|環境|支援|独居|同居|教育|嗜好")
+_RE_GORDON  = re.compile(r"ゴードン|Gordon")
+_RE_HEND    = re.compile(r"ヘンダーソン|Henderson")
+_RE_S_BLOCK = re.compile(r"(^|\n)\s*S[:：]\s*(.+?)(?=\n[OＳＯoｏ][:：]|\Z)", re.S|re.I)
+_RE_O_BLOCK = re.compile(r"(^|\n)\s*O[:：]\s*(.+?)(?=\n[AＳＳsｓ][:：]|$)", re.S|re.I)
+
 def extract_blocks_from_assess(text: str) -> Dict[str,str]:
     """S/O を分けず、両方を結合して『SO』として返す。無ければ全文の要所を SO に入れる。"""
     t = clean(text)
-    ms = re.search(r"(^|\n)\s*S[:：]\s*(.+?)(?=\n[OＳＯoｏ][:：]|\Z)", t, flags=re.S|re.I)
-    mo = re.search(r"(^|\n)\s*O[:：]\s*(.+?)(?=\n[AＳＳsｓ][:：]|$)", t, flags=re.S|re.I)
+    ms = _RE_S_BLOCK.search(t)
+    mo = _RE_O_BLOCK.search(t)
     s_txt = ms and ms.group(2).strip() or ""
     o_txt = mo and mo.group(2).strip() or ""
     so_raw = "\n".join([x for x in [s_txt, o_txt] if x]) or t
@@ -227,6 +317,7 @@ def extract_blocks_from_assess(text: str) -> Dict[str,str]:
         lines_sorted = sorted(lines, key=_score_line_importance, reverse=True)
         buf=[]; total=0
         for ln in lines_sorted:
+            if total > TRIM_CHARS - 2: break  # 1 文字の行（+改行）すら入らない。残りを見ても足せない
             ln2 = ln.strip()
             if not ln2: continue
             if total + len(ln2) + 1 > TRIM_CHARS: continue
@@ -238,25 +329,34 @@ def extract_blocks_from_assess(text: str) -> Dict[str,str]:
     else:
         so_use = so_raw
 
-    # 背景・枠組み（必要最低限の抽出のみ）
-    bg = []
-    for ln in t.splitlines():
-        if any(key in ln for key in ("背景","既往","家族","生活","仕事","社会","経済","環境","支援","独居","同居","教育","嗜好")):
-            bg.append(ln.strip())
-    gordon = "\n".join([ln for ln in t.splitlines() if "ゴードン" in ln or "Gordon" in ln])
-    hend   = "\n".join([ln for ln in t.splitlines() if "ヘンダーソン" in ln or "Henderson" in ln])
+    # 背景・枠組み（必要最低限の抽出のみ）。行分割は 1 回、キーワードは 1 本の正規表現で照合
+    lines_all = t.splitlines()
+    bg     = [ln.strip() for ln in lines_all if _RE_BG_KEYS.search(ln)]
+    gordon = "\n".join([ln for ln in lines_all if _RE_GORDON.search(ln)])
+    hend   = "\n".join([ln for ln in lines_all if _RE_HEND.search(ln)])
     return {"SO": so_use, "背景": "\n".join(bg[:6]), "ゴードン": gordon, "ヘンダーソン": hend, "全文": t}
 
 # ====== diagnosis_final.txt のパース ======
+_RE_TERM_GROUP = re.compile(r"[|｜]")
+_RE_TERM_SEP   = re.compile(r"[、,;／/・\s]+")
+
 def split_terms(s: str) -> List[str]:
     if not s: return []
     parts=[]
-    for chunk in re.split(r"[|｜]", s):
-        for sub in re.split(r"[、,;／/・\s]+", chunk):
+    for chunk in _RE_TERM_GROUP.split(s):
+        for sub in _RE_TERM_SEP.split(chunk):
             sub=sub.strip("・-・:：;、, ")
             if sub: parts.append(nfkc(sub))
     return uniq_keep(parts)
 
+# 見出し行（「- [x] コード 名称」または「1. [コード] 名称」）を 1 回の match で判定する
+_RE_DIAG_HEAD = re.compile(r"^\s*(?:-\s*\[\s*[xX]?\s*\]\s*([0-9A-Za-z\-]+)\s*\t?|\d+\.\s*\[([0-9A-Za-z\-]+)\])\s*(.+?)\s*$")
+_RE_DEF   = re.compile(r"定義[:：]\s*(.+)")
+_RE_DC    = re.compile(r"診断指標[:：]\s*(.+)")
+_RE_RF    = re.compile(r"関連因子[:：]\s*(.+)")
+_RE_RK    = re.compile(r"危険因子[:：]\s*(.+)")
+_RE_STATE = re.compile(r"診断の状態[:：]\s*(問題焦点型|リスク型|ヘルスプロモーション)")
+
 def parse_diagnosis_final(txt: str) -> List[Dict[str,any]]:
     items=[]
     cur=None
@@ -269,31 +369,30 @@ def parse_diagnosis_final(txt: str) -> List[Dict[str,any]]:
             items.append(cur); cur=None
 
     for ln in txt.splitlines():
-        m1 = re.match(r"^\s*-\s*\[\s*[xX]?\s*\]\s*([0-9A-Za-z\-]+)\s*\t?\s*(.+?)\s*$", ln)
-        m2 = re.match(r"^\s*\d+\.\s*\[([0-9A-Za-z\-]+)\]\s*(.+?)\s*$", ln)
-        if m1 or m2:
+        mh = _RE_DIAG_HEAD.match(ln)
+        if mh:
             flush()
-            code = (m1.group(1) if m1 else m2.group(1))
-            label= (m1.group(2) if m1 else m2.group(2))
+            code = mh.group(1) or mh.group(2)
+            label= mh.group(3)
             cur = {"code": code.strip(), "label": nfkc(label), "definition":"", "診断指標":[], "関連因子":[], "危険因子":[], "diagnosis_state":""}
             continue
         if cur is None:
             continue
         if "定義" in ln:
-            m = re.search(r"定義[:：]\s*(.+)", ln)
+            m = _RE_DEF.search(ln)
             if m: cur["definition"] = nfkc(m.group(1)).strip()
         if "診断指標" in ln:
-            m = re.search(r"診断指標[:：]\s*(.+)", ln)
+            m = _RE_DC.search(ln)
             if m: cur["診断指標"] += split_terms(m.group(1))
         if "関連因子" in ln:
-            m = re.search(r"関連因子[:：]\s*(.+)", ln)
+            m = _RE_RF.search(ln)
             if m: cur["関連因子"] += split_terms(m.group(1))
         if "危険因子" in ln:
-            m = re.search(r"危険因子[:：]\s*(.+)", ln)
+            m = _RE_RK.search(ln)
             if m: cur["危険因子"] += split_terms(m.group(1))
-        mstate = re.search(r"診断の状態[:：]\s*(問題焦点型|リスク型|ヘルスプロモーション)", ln)
-        if mstate:
-            cur["diagnosis_state"] = mstate.group(1)
+        if "診断の状態" in ln:
+            mstate = _RE_STATE.search(ln)
+            if mstate: cur["diagnosis_state"] = mstate.group(1)
     flush()
     # 推定（無ければ）
     for it in items:
@@ -341,19 +440,64 @@ AI_REC_SYS = (
     "箇条書き・記号は使わない。文字数の制約は一切設けない。"
 )
 
-def _ai_cache_load(path:str) -> dict:
-    if Path(path).exists():
-        try:
-            return json.loads(Path(path).read_text(encoding="utf-8"))
-        except Exception:
-            return {}
-    return {}
+_SQLITE_MAGIC = b"SQLite format 3\x00"
 
-def _ai_cache_save(path:str, cache:dict):
-    try:
-        Path(path).write_text(json.dumps(cache, ensure_ascii=False, indent=2), encoding="utf-8")
-    except Exception:
-        pass
+class _CacheDB:
+    """AI 応答キャッシュ（SQLite / WAL）。毎回全件を書き直さず、新しい応答だけ 1 行ずつ書く。
+    並列スレッドから使うので 1 接続をロックで共有する。DB が開けなければメモリ上の dict で代用（stderr に警告）"""
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._mem: Dict[str, str] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        try:
+            p = Path(path); legacy = AI_CACHE_LEGACY_JSON
+            # RECORD_AI_CACHE が旧 JSON キャッシュのままなら、横に退避してから DB を作り、中身を取り込む
+            if p.is_file() and p.stat().st_size > 0:
+                with open(p, "rb") as f: head = f.read(len(_SQLITE_MAGIC))
+                if head != _SQLITE_MAGIC:
+                    legacy = str(p.with_name(p.name + ".legacy.json")); os.replace(p, legacy)
+                    print(f"[WARN] {path} は SQLite ではないため {legacy} に退避して取り込みます", file=sys.stderr)
+            is_new = not p.exists() or p.stat().st_size == 0
+            db = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS cache (hash_key TEXT PRIMARY KEY, text TEXT NOT NULL, ts INTEGER NOT NULL)")
+            self._db = db
+            if is_new: self._import_json(legacy)
+        except Exception as e:
+            self._db = None
+            print(f"[WARN] AI キャッシュ {path} を開けません（{e}）。今回の応答はメモリ上だけに置き、保存しません", file=sys.stderr)
+
+    def _import_json(self, path: str):
+        try: old = _json_loads(Path(path).read_bytes())
+        except Exception: return
+        if not isinstance(old, dict): return
+        now = int(time.time())
+        self._db.execute("BEGIN")  # 1 トランザクションでまとめて入れる
+        self._db.executemany("INSERT OR IGNORE INTO cache VALUES (?,?,?)",
+                             [(str(k), str(v), now) for k, v in old.items() if v])
+        self._db.execute("COMMIT")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if self._db is None: return self._mem.get(key)
+            try: row = self._db.execute("SELECT text FROM cache WHERE hash_key=?", (key,)).fetchone()
+            except Exception: return None
+        return row[0] if row else None
+
+    def put(self, key: str, text: str):
+        with self._lock:
+            if self._db is None: self._mem[key] = text; return
+            try: self._db.execute("INSERT OR REPLACE INTO cache VALUES (?,?,?)", (key, text, int(time.time())))
+            except Exception: pass
+
+    def close(self):
+        # 打ち切った呼び出しが後から put しても、以降はメモリ側に入るだけ
+        with self._lock:
+            if self._db is not None:
+                try: self._db.close()
+                except Exception: pass
+                self._db = None
 
 def _narrative_key(di: Dict[str,any], assess: Dict[str,str], vnote: str) -> str:
     # モデル＋診断＋（短縮済）SO/背景/G/H/バイタル からキーを作成
@@ -374,33 +518,44 @@ def _narrative_key(di: Dict[str,any], assess: Dict[str,str], vnote: str) -> str:
     }, ensure_ascii=False, sort_keys=True)
     return hashlib.sha1(src.encode("utf-8","ignore")).hexdigest()
 
+@functools.lru_cache(maxsize=4)
+def _shared_prompt_head(so: str, bg: str, gordon: str, hend: str, vnote: str) -> str:
+    # 診断が何件あっても共通部分の組み立ては 1 回（同じ str オブジェクトが渡るのでハッシュも再計算しない）
+    return (
+        f"【S/O本文（重要行優先・短縮）】\n{so}\n\n"
+        f"【背景】\n{bg}\n"
+        f"【ゴードン】\n{gordon}\n"
+        f"【ヘンダーソン】\n{hend}\n"
+        f"【バイタル所見】{vnote}\n\n"
+    )
+
 def _build_user_prompt(di: Dict[str,any], assess: Dict[str,str], vnote: str) -> str:
+    # 全診断で共通の S/O・背景を先頭に、診断ごとに変わる部分を末尾に置く
+    # （同じ患者の N 件の呼び出しで先頭が同一になり、Ollama が共通部分の KV キャッシュを使い回せる）
     tp = di.get("diagnosis_state","問題焦点型")
-    return (
+    return _shared_prompt_head(assess.get('SO',''), assess.get('背景',''), assess.get('ゴードン',''),
+                               assess.get('ヘンダーソン',''), vnote) + (
         f"【診断タイプ】{tp}\n"
         f"【看護診断名】{di['label']} [{di['code']}]\n"
         f"【定義】{di.get('definition','')}\n"
         f"【関連因子】{', '.join(di.get('関連因子',[])[:12])}\n"
         f"【危険因子】{', '.join(di.get('危険因子',[])[:12])}\n"
-        f"【診断指標】{', '.join(di.get('診断指標',[])[:12])}\n\n"
-        f"【S/O本文（重要行優先・短縮）】\n{assess.get('SO','')}\n\n"
-        f"【背景】\n{assess.get('背景','')}\n"
-        f"【ゴードン】\n{assess.get('ゴードン','')}\n"
-        f"【ヘンダーソン】\n{assess.get('ヘンダーソン','')}\n"
-        f"【バイタル所見】{vnote}\n"
+        f"【診断指標】{', '.join(di.get('診断指標',[])[:12])}\n"
     )
 
 def ai_narrative_once(di: Dict[str,any], assess: Dict[str,str], vnote: str,
                       allow_ai: bool, per_call_timeout: float,
-                      cache: dict) -> str:
+                      cache: _CacheDB) -> str:
     key = _narrative_key(di, assess, vnote)
-    if key in cache:
-        return cache[key]
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
     if allow_ai:
         try:
-            text = clean(_ollama_chat(AI_REC_SYS, _build_user_prompt(di, assess, vnote), timeout=per_call_timeout))
+            text, complete = _ollama_chat(AI_REC_SYS, _build_user_prompt(di, assess, vnote), timeout=per_call_timeout)
+            text = clean(text)
             if text:
-                cache[key] = text
+                if complete: cache.put(key, text)  # num_predict 切れなど途中で切れた本文はキャッシュしない
                 return text
         except Exception:
             pass
@@ -418,11 +573,20 @@ def ai_narrative_once(di: Dict[str,any], assess: Dict[str,str], vnote: str,
         text = clean(f"{di['label']}では、背景やS/Oから {fmt_join(di.get('関連因子',[]))} が関与し、"
                      f"{fmt_join(di.get('診断指標',[]) or symptom_hits(assess.get('SO','')))} がみられる。{vnote} を考慮し、"
                      f"疼痛・呼吸・循環・安全の観察と生活調整、教育を中心に介入する。")
-    cache[key] = text
+    cache.put(key, text)
     return text
 
 # ====== メイン ======
 def main():
+    # Ollama の疎通確認（最大 CONNECT_TO 秒）は入力の読み込み・解析・テンプレ作成と並行して走らせる
+    probe: Dict[str, bool] = {}
+    def _probe():
+        probe["ok"] = ok = _ollama_ok()
+        # 疎通できたらすぐモデルのロードを始める（解析・テンプレ作成やキャッシュ確認と重ねる）
+        if ok: threading.Thread(target=_ollama_warm, daemon=True).start()
+    probe_th = threading.Thread(target=_probe, daemon=True)
+    probe_th.start()
+
     assess_text = read_text(ASSESS1) or read_text(ASSESS2)
     if not assess_text:
         raise SystemExit("assessment_final.txt / assessment_result.txt が見つかりません。")
@@ -435,9 +599,6 @@ def main():
     vnote  = " ".join(abnormal_vitals(v)) or "特記すべき急性異常はない"
     diags  = parse_diagnosis_final(diag_text)
 
-    allow_ai_global = (not DISABLE_AI) and _ollama_ok()
-    start_time = time.time()
-
     # ===== 先にテンプレを全部作る =====
     templated = []
     for di in diags:
@@ -445,7 +606,10 @@ def main():
 
     # ===== AI肉付け（上位 AI_TOPK 件・並列・時間配分） =====
     ai_count = min(AI_TOPK, len(diags))
-    cache = _ai_cache_load(AI_CACHE_PATH)
+    cache = _CacheDB(AI_CACHE_PATH)
+    probe_th.join()
+    allow_ai_global = (not DISABLE_AI) and probe.get("ok", False)
+    start_time = time.time()  # AI 予算は疎通確認が済んでから数える（従来どおり）
 
     # 残り時間に応じて 1呼び出しtimeoutを動的短縮
     def dyn_timeout(pending: int) -> float:
@@ -456,8 +620,9 @@ def main():
         # 作業残が0は呼ばないので安全
         # 余裕を持って9割を割り振り（失敗リカバリ余地）
         if pending <= 0 or remain <= 0:
-            return 0.5
-        return max(3.0, min(PER_CALL_TO_DEF, 0.9 * remain / pending))
+            return 0.0
+        # 下限 3 秒は残り予算を超えない範囲で（実行中の呼び出しも予算内に終わらせる）
+        return min(remain, max(3.0, min(PER_CALL_TO_DEF, 0.9 * remain / pending)))
 
     ai_texts = [""] * len(diags)
 
@@ -468,7 +633,7 @@ def main():
         def task(idx: int):
             # ここで都度 timeout を見直す（残タスク基準）
             to = dyn_timeout(pending = max(1, len(pending_set())))
-            return idx, ai_narrative_once(diags[idx], assess, vnote, allow_ai=True, per_call_timeout=to, cache=cache)
+            return idx, ai_narrative_once(diags[idx], assess, vnote, allow_ai=to > 0, per_call_timeout=to, cache=cache)
 
         # スレッド間で残数を見るためのクロージャ
         running = set()
@@ -476,23 +641,32 @@ def main():
             return set(idxs) - set(done_order)
 
         done_order = []
-        with ThreadPoolExecutor(max_workers=max(1, AI_WORKERS)) as ex:
-            futs = []
-            for i in idxs:
-                f = ex.submit(task, i)
-                running.add(i); futs.append(f)
-            for f in as_completed(futs):
+        ex = ThreadPoolExecutor(max_workers=max(1, AI_WORKERS))
+        futs = {ex.submit(task, i): i for i in idxs}
+        running.update(idxs)
+        try:
+            # 予算があれば残り時間だけ待つ。間に合わなかった分は待たずにフォールバックへ回す
+            budget_left = (AI_BUDGET_SEC - (time.time() - start_time)) if AI_BUDGET_SEC > 0 else None
+            for f in as_completed(futs, timeout=budget_left):
+                i = futs[f]
                 try:
-                    i, txt = f.result()
+                    _, txt = f.result()
                 except Exception:
                     # フォールバック
-                    i = idxs[len(done_order)]
                     txt = ai_narrative_once(diags[i], assess, vnote, allow_ai=False, per_call_timeout=0.0, cache=cache)
                 ai_texts[i] = txt
                 done_order.append(i)
-                # 予算超過なら以降はフォールバックに切替
-                if AI_BUDGET_SEC > 0 and (time.time() - start_time) >= AI_BUDGET_SEC:
-                    break
+        except FuturesTimeout:
+            pass
+        finally:
+            # 未着手は取り消す。実行中の呼び出しは dyn_timeout で予算内に切れるので、その終了を待つ
+            # （待たずに戻っても終了時の join で結局待たされ、キャッシュ書き込みも後から走るため）
+            ex.shutdown(wait=True, cancel_futures=True)
+        # 待った分は使う: 予算切れ後に終わった呼び出しの結果も拾う（取り消し・例外はこの後のフォールバックへ）
+        for f, i in futs.items():
+            if ai_texts[i] or not f.done() or f.cancelled(): continue
+            try: ai_texts[i] = f.result()[1]
+            except Exception: pass
 
         # 予算切れで未生成分はフォールバック
         for i in range(ai_count):
@@ -508,7 +682,7 @@ def main():
         ai_texts[i] = ai_narrative_once(diags[i], assess, vnote, allow_ai=False, per_call_timeout=0.0, cache=cache)
 
     # キャッシュ保存
-    _ai_cache_save(AI_CACHE_PATH, cache)
+    cache.close()  # 応答は生成のたびに書いてあるので、最後の全件保存は不要
 
     # ===== 出力組み立て（青四角は無しのまま） =====
     lines=[]
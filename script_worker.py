@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+script_worker.py — 常駐スクリプト実行ワーカー（nurse_app から QProcess で起動）
+assessment.py などを同一プロセス内で繰り返し実行し、インタプリタ起動と重いライブラリの import を初回だけにする。
+フレーム形式: 4 バイト長（big endian）+ UTF-8 JSON
+  要求: {"script": "assessment.py", "stdin": "..."}
+  応答: {"rc": 0, "out": "...", "err": "..."}
+"""
+import io, os, sys, json, struct, traceback, builtins
+
+# 起動直後に読み込んでおくライブラリ（無ければ無視）
+PRELOAD = ["numpy", "pandas", "openpyxl", "requests", "urllib.request"]
+
+def _read_exact(f, n: int):
+    buf = b""
+    while len(buf) < n:
+        chunk = f.read(n - len(buf))
+        if not chunk: return None
+        buf += chunk
+    return buf
+
+def read_frame(f):
+    head = _read_exact(f, 4)
+    if head is None: return None
+    body = _read_exact(f, struct.unpack(">I", head)[0])
+    return None if body is None else json.loads(body.decode("utf-8"))
+
+def write_frame(f, obj) -> None:
+    b = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+    f.write(struct.pack(">I", len(b)) + b); f.flush()
+
+_CODE_CACHE: dict = {}
+
+def _compiled(script: str):
+    # コンパイル済みコードをキャッシュ（ファイルが変わったときだけ再コンパイル）
+    st = os.stat(script); sig = (st.st_mtime_ns, st.st_size)
+    c = _CODE_CACHE.get(script)
+    if c and c[0] == sig: return c[1]
+    with open(script, "rb") as f: code = compile(f.read(), script, "exec")
+    _CODE_CACHE[script] = (sig, code)
+    return code
+
+def run_script(script: str, stdin_text: str) -> dict:
+    # runpy ではなく、コンパイル済みコードを __main__ として exec する（ファイルが変わらない限り再コンパイルしない）
+    # stdout/stderr はどちらも取り込み、stderr は応答の "err" に入れる（失敗時のダイアログに診断情報を出すため）
+    old_in, old_out, old_err, old_argv = sys.stdin, sys.stdout, sys.stderr, sys.argv
+    buf_out, buf_err = io.StringIO(), io.StringIO()
+    sys.stdin, sys.stdout, sys.stderr, sys.argv = io.StringIO(stdin_text or ""), buf_out, buf_err, [script]
+    rc, err = 0, ""
+    try:
+        exec(_compiled(script), {"__name__": "__main__", "__file__": script,
+                                 "__builtins__": builtins, "__package__": None, "__spec__": None})
+    except SystemExit as e:
+        code = e.code
+        if code is None: rc = 0
+        elif isinstance(code, int): rc = code
+        else: rc, err = 1, str(code)
+    except BaseException:
+        rc, err = 1, traceback.format_exc()
+    finally:
+        sys.stdin, sys.stdout, sys.stderr, sys.argv = old_in, old_out, old_err, old_argv
+    err = buf_err.getvalue() + err
+    return {"rc": rc, "out": buf_out.getvalue(), "err": err}
+
+def main():
+    # フレーム用に元の stdout を退避し、fd 1 は stderr へ向ける（スクリプトや孫プロセスの出力でフレームが壊れないように）
+    frames_in = sys.stdin.buffer
+    frames_out = os.fdopen(os.dup(1), "wb")
+    sys.stdout.flush(); os.dup2(2, 1)
+    for m in PRELOAD:
+        try: __import__(m)
+        except Exception: pass
+    while True:
+        req = read_frame(frames_in)
+        if req is None: break  # 親が閉じた
+        write_frame(frames_out, run_script(str(req.get("script") or ""), req.get("stdin") or ""))
+
+if __name__ == "__main__":
+    main()